@@ -0,0 +1,251 @@
+"""
+Soltify/Bench/Synthetic
+
+Helper class, SyntheticClient, that stands in for a spotipy client backed by a
+generated library, set of playlists and artist graph of any size. Everything
+is generated on demand from a seed, so even huge libraries use little memory
+and every run sees the same data.
+"""
+import json
+import random
+import threading
+from datetime import datetime, timedelta
+
+from ..common import replay
+
+# Name of the generated playlist that holds num_tracks songs
+SYNTHETIC_PLAYLIST_NAME = "Synthetic Playlist"
+
+# Shape of the generated data
+TRACKS_PER_ARTIST = 8
+RELATED_PER_ARTIST = 20
+RELATED_NEIGHBORHOOD = 200
+ALBUMS_PER_ARTIST = 6
+NUM_PLAYLISTS = 50
+ALBUM_GROUPS = ["album", "single", "appears_on"]
+
+# Shape of the new release feed: how many releases are in the new release
+# listings, and how many days back the search for new releases goes
+NEW_RELEASES_LISTED = 100
+NEW_RELEASE_SEARCH_DAYS = 14
+
+# Prefix of "next" URLs in generated pages
+NEXT_PREFIX = "synthetic:"
+
+class SyntheticClient:
+    """
+    Fake spotipy client with a library of num_tracks liked songs, a playlist
+    named SYNTHETIC_PLAYLIST_NAME with num_tracks songs, and an artist graph
+    with related artists and discographies for every artist
+    """
+    def __init__(self, num_tracks, seed=0, latency=None, now=None):
+        if latency is None:
+            latency = replay.LatencyModel()
+        if now is None:
+            now = datetime.now()
+        self.num_tracks = num_tracks
+        self.num_artists = max(RELATED_PER_ARTIST + 1, num_tracks // TRACKS_PER_ARTIST)
+        self.seed = seed
+        self.latency = latency
+        self.now = now
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self.release_feed = None
+
+    ############################################################################
+    # spotipy functions
+    ############################################################################
+    def current_user_saved_tracks(self, limit=20, offset=0, market=None):
+        items = [self._item(i, i) for i in range(offset, min(offset + limit, self.num_tracks))]
+        return self._page("current_user_saved_tracks", [], items, limit, offset, self.num_tracks)
+
+    def current_user_playlists(self, limit=50, offset=0):
+        items = []
+        for i in range(offset, min(offset + limit, NUM_PLAYLISTS)):
+            if i == NUM_PLAYLISTS - 1:
+                name = SYNTHETIC_PLAYLIST_NAME
+            else:
+                name = "Playlist {}".format(i)
+            items.append({"name": name, "uri": "spotify:playlist:" + _make_id("p", i)})
+        return self._page("current_user_playlists", [], items, limit, offset, NUM_PLAYLISTS)
+
+    def playlist_items(self, playlist_id, fields=None, limit=100, offset=0, market=None,
+                       additional_types=("track", "episode")):
+        # Use a different slice of tracks than the library so the two overlap
+        # only partly
+        shift = self.num_tracks // 2
+        items = [self._item(i + shift, i) for i in range(offset, min(offset + limit, self.num_tracks))]
+        return self._page("playlist_items", [playlist_id], items, limit, offset, self.num_tracks)
+
+    def artist_related_artists(self, artist_id):
+        index = _parse_id(artist_id)
+        rng = self._random("related", index)
+        related = set()
+        while len(related) < RELATED_PER_ARTIST:
+            other = (index + rng.randint(1, RELATED_NEIGHBORHOOD)) % self.num_artists
+            if other != index:
+                related.add(other)
+        return self._respond({"artists": [self._artist(a) for a in sorted(related)]})
+
+    def artist_albums(self, artist_id, album_type=None, include_groups=None, country=None, limit=20, offset=0):
+        groups = (include_groups or album_type or ",".join(ALBUM_GROUPS)).split(",")
+        albums = [a for a in self._discography(_parse_id(artist_id)) if a["album_group"] in groups]
+        items = albums[offset:offset + limit]
+        kwargs = {"album_type": album_type, "include_groups": include_groups}
+        return self._page("artist_albums", [artist_id], items, limit, offset, len(albums), kwargs)
+
+    def new_releases(self, country=None, limit=20, offset=0):
+        albums = self._release_feed()[:NEW_RELEASES_LISTED]
+        items = albums[offset:offset + limit]
+        return self._page("new_releases", [], items, limit, offset, len(albums), {"country": country}, "albums")
+
+    def search(self, q, limit=10, offset=0, type="track", market=None):
+        # Only the album search for new releases is supported
+        min_date = self.now - timedelta(days=NEW_RELEASE_SEARCH_DAYS)
+        albums = [album for release_date, album in self._dated_release_feed() if release_date >= min_date]
+        items = albums[offset:offset + limit]
+        kwargs = {"q": q, "type": type, "market": market}
+        return self._page("search", [], items, limit, offset, len(albums), kwargs, "albums")
+
+    def playlist_replace_items(self, playlist_id, items):
+        return self._respond({"snapshot_id": "synthetic"})
+
+    def playlist_add_items(self, playlist_id, items, position=None):
+        return self._respond({"snapshot_id": "synthetic"})
+
+    def next(self, result):
+        if not result["next"]:
+            return None
+        func, args, kwargs = json.loads(result["next"][len(NEXT_PREFIX):])
+        return getattr(self, func)(*args, **kwargs)
+
+    ############################################################################
+    # Private Functions
+    ############################################################################
+    def _random(self, kind, index):
+        """
+        Get a random number generator that always gives the same values for
+        the same kind of data and index
+        """
+        return random.Random("{}:{}:{}".format(self.seed, kind, index))
+
+    def _respond(self, result):
+        """
+        Count a request and simulate its network latency
+        """
+        with self.lock:
+            self.request_count += 1
+        self.latency.delay(len(json.dumps(result)))
+        return result
+
+    def _page(self, func, args, items, limit, offset, total, kwargs=None, key=None):
+        """
+        Build a paged response in the same format Spotify uses. If key is
+        given, the page is wrapped in a dictionary under that key (as in
+        search results).
+        """
+        kwargs = dict(kwargs or {}, limit=limit, offset=offset + limit)
+        next_url = None
+        if offset + limit < total:
+            next_url = NEXT_PREFIX + json.dumps([func, args, kwargs])
+        page = {"items": items, "total": total, "next": next_url}
+        return self._respond({key: page} if key else page)
+
+    def _artist(self, index):
+        return {"id": _make_id("a", index), "name": "Artist {}".format(index)}
+
+    def _item(self, track_index, position):
+        """
+        Build a saved-track/playlist item for a track. The newest item is at
+        position 0 and each older one was added an hour earlier.
+        """
+        rng = self._random("track", track_index)
+        # Square the random number so a few artists have most of the songs
+        artist = int(self.num_artists * rng.random() ** 2)
+        release_date = self.now - timedelta(days=rng.expovariate(1 / (365.25 * 8)))
+        added_at = self.now - timedelta(hours=position)
+        track = {
+            "name": "Track {}".format(track_index),
+            "artists": [self._artist(artist)],
+            "album": dict(_format_release_date(release_date, rng), name="Album {}".format(track_index // 10)),
+            "uri": "spotify:track:" + _make_id("t", track_index),
+            "popularity": rng.randint(0, 100),
+            "duration_ms": rng.randint(90000, 420000),
+            "explicit": rng.random() < 0.2,
+        }
+        return {"added_at": added_at.strftime("%Y-%m-%dT%H:%M:%SZ"), "track": track}
+
+    def _discography(self, artist):
+        """
+        Build all albums for an artist, grouped the way Spotify returns them
+        (by album_group, newest first within each group)
+        """
+        return [album for release_date, album in self._dated_discography(artist)]
+
+    def _dated_discography(self, artist):
+        """
+        Build all albums for an artist as (release date, album) pairs, in the
+        same order as _discography()
+        """
+        rng = self._random("albums", artist)
+        albums = []
+        for i in range(ALBUMS_PER_ARTIST):
+            release_date = self.now - timedelta(days=rng.expovariate(1 / (365.25 * 3)))
+            album = dict(_format_release_date(release_date, rng),
+                name="Release {} by Artist {}".format(i, artist),
+                artists=[self._artist(artist)],
+                id=_make_id("l", artist * ALBUMS_PER_ARTIST + i),
+                album_group=rng.choice(ALBUM_GROUPS))
+            album["album_type"] = album["album_group"].replace("appears_on", "album")
+            albums.append((release_date, album))
+        grouped = []
+        for group in ALBUM_GROUPS:
+            in_group = [entry for entry in albums if entry[1]["album_group"] == group]
+            in_group.sort(key=lambda entry: entry[0], reverse=True)
+            grouped.extend(in_group)
+        return grouped
+
+    def _release_feed(self):
+        return [album for release_date, album in self._dated_release_feed()]
+
+    def _dated_release_feed(self):
+        """
+        Build the (release date, album) pairs of every album and single by
+        any artist, newest first. Releases that artists appear on belong to
+        other artists, so they aren't listed again.
+        """
+        with self.lock:
+            if self.release_feed is None:
+                feed = []
+                for artist in range(self.num_artists):
+                    feed.extend(entry for entry in self._dated_discography(artist)
+                                if entry[1]["album_group"] != "appears_on")
+                feed.sort(key=lambda entry: entry[0], reverse=True)
+                self.release_feed = feed
+            return self.release_feed
+
+def _format_release_date(release_date, rng):
+    """
+    Format a release date the way Spotify does, usually to the day but
+    sometimes only to the month or year
+    """
+    precision = rng.choices(["day", "month", "year"], weights=[90, 5, 5])[0]
+    if precision == "day":
+        text = release_date.strftime("%Y-%m-%d")
+    elif precision == "month":
+        text = release_date.strftime("%Y-%m")
+    else:
+        text = release_date.strftime("%Y")
+    return {"release_date": text, "release_date_precision": precision}
+
+def _make_id(kind, index):
+    """
+    Make a 22 character Spotify-style ID for the index-th item of a kind
+    """
+    return "{}{:021d}".format(kind, index)
+
+def _parse_id(spotify_id):
+    """
+    Get back the index of an ID made by _make_id()
+    """
+    return int(spotify_id[1:])
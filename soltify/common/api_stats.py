@@ -0,0 +1,170 @@
+"""
+Soltify/Common/API Stats
+
+Helper class, ApiStats, that records per-endpoint telemetry (call counts,
+latency, bytes received, retries, cache hits) for requests made to Spotify
+"""
+import json
+import re
+import threading
+
+# Upper bound (in milliseconds) of each latency histogram bucket. The last
+# bucket catches everything slower.
+LATENCY_BUCKETS_MS = [25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# Friendly names for the endpoints we use, keyed by (HTTP method, path template)
+ENDPOINT_NAMES = {
+    ("GET", "me/tracks"): "current_user_saved_tracks",
+    ("GET", "me/playlists"): "current_user_playlists",
+    ("GET", "playlists/{id}/tracks"): "playlist_items",
+    ("POST", "playlists/{id}/tracks"): "playlist_add_items",
+    ("PUT", "playlists/{id}/tracks"): "playlist_replace_items",
+    ("GET", "artists/{id}/albums"): "artist_albums",
+    ("GET", "artists/{id}/related-artists"): "artist_related_artists",
+    ("GET", "browse/new-releases"): "new_releases",
+    ("GET", "search"): "search",
+}
+
+# Spotify IDs are 22 base62 characters
+SPOTIFY_ID_PATTERN = re.compile(r"^[0-9A-Za-z]{22}$")
+
+class ApiStats:
+    """
+    Thread-safe collection of telemetry for each Spotify API endpoint
+    """
+    def __init__(self):
+        self.endpoints = dict()
+        self.lock = threading.Lock()
+
+    def endpoint_name(self, method, url):
+        """
+        Get the name to record a request under. Known endpoints get the name of
+        the matching spotipy function, others get "<METHOD> <path template>".
+        """
+        # Strip the scheme/host/version prefix and the query string
+        path = url.split("?")[0]
+        if "/v1/" in path:
+            path = path.split("/v1/", 1)[1]
+        parts = ["{id}" if SPOTIFY_ID_PATTERN.match(p) else p for p in path.strip("/").split("/")]
+        template = "/".join(parts)
+        return ENDPOINT_NAMES.get((method, template), "{} {}".format(method, template))
+
+    def record_call(self, endpoint, seconds, num_bytes, error=False):
+        """
+        Record one completed request (successful or not)
+        """
+        latency_ms = seconds * 1000.0
+        bucket = len(LATENCY_BUCKETS_MS)
+        for i, limit in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= limit:
+                bucket = i
+                break
+        with self.lock:
+            entry = self._get_entry(endpoint)
+            entry["calls"] += 1
+            entry["errors"] += int(error)
+            entry["bytes"] += num_bytes
+            entry["total_ms"] += latency_ms
+            entry["max_ms"] = max(entry["max_ms"], latency_ms)
+            entry["histogram"][bucket] += 1
+
+    def record_retry(self, endpoint):
+        """
+        Record that a request was throttled and will be retried
+        """
+        with self.lock:
+            self._get_entry(endpoint)["retries"] += 1
+
+    def record_cache_hit(self, endpoint):
+        """
+        Record that a request to this endpoint was avoided by using cached data
+        """
+        with self.lock:
+            self._get_entry(endpoint)["cache_hits"] += 1
+
+    def total_calls(self):
+        """
+        Get the number of requests made to all endpoints so far
+        """
+        with self.lock:
+            return sum(entry["calls"] for entry in self.endpoints.values())
+
+    def to_dict(self):
+        """
+        Get a copy of all stats, including estimated latency percentiles, that
+        can be saved as JSON
+        """
+        with self.lock:
+            result = dict()
+            for endpoint, entry in sorted(self.endpoints.items()):
+                entry = dict(entry, histogram=list(entry["histogram"]))
+                entry["avg_ms"] = entry["total_ms"] / entry["calls"] if entry["calls"] else 0.0
+                entry["p50_ms"] = _percentile(entry, 0.50)
+                entry["p95_ms"] = _percentile(entry, 0.95)
+                result[endpoint] = entry
+            return {"latency_buckets_ms": LATENCY_BUCKETS_MS, "endpoints": result}
+
+    def print_summary(self):
+        """
+        Print a table summarizing each endpoint to the console
+        """
+        endpoints = self.to_dict()["endpoints"]
+        print("API stats:")
+        print("  {:<28} {:>7} {:>7} {:>6} {:>6} {:>8} {:>8} {:>8} {:>10}".format(
+            "Endpoint", "Calls", "Retries", "Cache", "Errors", "Avg ms", "p95 ms", "Total s", "KB"))
+        for endpoint, entry in endpoints.items():
+            print("  {:<28} {:>7} {:>7} {:>6} {:>6} {:>8.1f} {:>8} {:>8.1f} {:>10.1f}".format(
+                endpoint, entry["calls"], entry["retries"], entry["cache_hits"], entry["errors"],
+                entry["avg_ms"], _format_bound(entry["p95_ms"]), entry["total_ms"] / 1000.0,
+                entry["bytes"] / 1024.0))
+
+    def save(self, path):
+        """
+        Write all stats to a .json file
+        """
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    ############################################################################
+    # Private Functions
+    ############################################################################
+    def _get_entry(self, endpoint):
+        """
+        Get the stats for an endpoint, creating a blank entry the first time.
+        Must be called with the lock held.
+        """
+        if not endpoint in self.endpoints:
+            self.endpoints[endpoint] = {
+                "calls": 0,
+                "retries": 0,
+                "cache_hits": 0,
+                "errors": 0,
+                "bytes": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            }
+        return self.endpoints[endpoint]
+
+def _percentile(entry, fraction):
+    """
+    Estimate a latency percentile from the histogram, as the upper bound of the
+    bucket it falls into. Returns None if it's in the last (unbounded) bucket.
+    """
+    target = entry["calls"] * fraction
+    count = 0
+    for i, bucket_count in enumerate(entry["histogram"]):
+        count += bucket_count
+        if count >= target and count > 0:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+    return 0
+
+def _format_bound(bound_ms):
+    """
+    Format a percentile returned by _percentile() for printing
+    """
+    if bound_ms is None:
+        return ">{}".format(LATENCY_BUCKETS_MS[-1])
+    if bound_ms == 0:
+        return "-"
+    return "<={}".format(bound_ms)
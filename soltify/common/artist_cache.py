@@ -0,0 +1,96 @@
+"""
+Soltify/Common/Artist Cache
+
+Helper class, ArtistCache, that holds artist-level data that is the same for
+every Spotify account (related artists and discographies), so
+that several accounts can share it instead of each fetching it again
+"""
+import threading
+import time
+
+# How long (in seconds) each kind of cached data is trusted before it is
+# fetched again. New releases come out all the time, so discographies expire
+# quickly; related artists change slowly.
+RELATED_ARTISTS_TTL = 30 * 24 * 60 * 60
+DISCOGRAPHY_TTL = 12 * 60 * 60
+
+class ArtistCache:
+    """
+    Thread-safe cache of artist-level data shared between Spotify connections
+    """
+    def __init__(self):
+        self.related_artists = dict()
+        self.discographies = dict()
+        self.lock = threading.Lock()
+
+    def get_related_artists(self, artist_id):
+        """
+        Get the cached (artist_ids, artist_names) related to an artist, or None
+        if they aren't cached
+        """
+        return self._get(self.related_artists, artist_id, RELATED_ARTISTS_TTL)
+
+    def set_related_artists(self, artist_id, artist_ids, artist_names):
+        self._set(self.related_artists, artist_id, (artist_ids, artist_names))
+
+    def get_discography(self, artist_id, min_time):
+        """
+        Get an artist's cached (albums, singles) that came out on or after
+        min_time, or None if the cache doesn't go back that far
+        """
+        entry = self._get(self.discographies, artist_id, DISCOGRAPHY_TTL)
+        if entry is None or entry["min_time"] > min_time:
+            return None
+        # Return copies, since each account adds its own data to its releases
+        return ([dict(album) for album in entry["albums"] if album["release_date"] >= min_time],
+                [dict(single) for single in entry["singles"] if single["release_date"] >= min_time])
+
+    def set_discography(self, artist_id, min_time, albums, singles):
+        """
+        Save all of an artist's albums and singles that came out on or after
+        min_time
+        """
+        self._set(self.discographies, artist_id, {"min_time": min_time,
+                                                  "albums": [dict(album) for album in albums],
+                                                  "singles": [dict(single) for single in singles]})
+
+    def expire(self):
+        """
+        Remove all entries that are too old to be used
+        """
+        now = time.time()
+        with self.lock:
+            for table, ttl in [(self.related_artists, RELATED_ARTISTS_TTL),
+                               (self.discographies, DISCOGRAPHY_TTL)]:
+                for key in [k for k, (saved, value) in table.items() if now - saved > ttl]:
+                    del table[key]
+
+    def __getstate__(self):
+        # Locks can't be pickled, so save everything else
+        with self.lock:
+            return {"related_artists": self.related_artists,
+                    "discographies": self.discographies}
+
+    def __setstate__(self, state):
+        # Caches saved by older versions also had critic ratings, which were
+        # never filled in
+        state.pop("critic_ratings", None)
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Private Functions
+    ############################################################################
+    def _get(self, table, key, ttl):
+        with self.lock:
+            entry = table.get(key)
+        if entry is None:
+            return None
+        saved, value = entry
+        if time.time() - saved > ttl:
+            return None
+        return value
+
+    def _set(self, table, key, value):
+        with self.lock:
+            table[key] = (time.time(), value)
@@ -3,16 +3,141 @@ Soltify/Common/File Manager
 
 Helper functions related to reading and writing spotify data to and from files
 """
+import contextlib
 import csv
+import importlib
 import os
 import pickle
 import re
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+
+# Only one of these exists, depending on the OS. They're used to lock the track
+# catalog while it's rewritten, since several tools can share a cache directory.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
 
 # Hard-coded filenames
 LIBRARY_FILENAME = "library.pkl"
 RELEASE_ALBUMS_FILENAME = "soltify_radar_albums.csv"
 RELEASE_SINGLES_FILENAME = "soltify_radar_singles.csv"
 TASTE_PROFILE_FILENAME = "soltify_taste_profile.csv"
+CHECKPOINT_FILENAME = "radar_checkpoint.pkl"
+ARTIST_CACHE_FILENAME = "artist_cache.pkl"
+PENDING_ARTISTS_FILENAME = "pending_artists.pkl"
+TRACK_CATALOG_FILENAME = "tracks.dat"
+TRACK_CATALOG_LOCK_FILENAME = "tracks.lock"
+LEGACY_TRACK_CATALOG_FILENAME = "tracks.pkl"
+
+# Files in a cache directory that aren't song lists. Every other .pkl file is
+# checked for the tracks it uses before unused tracks are dropped from the
+# catalog.
+NON_SONG_LIST_FILENAMES = [
+    CHECKPOINT_FILENAME,
+    ARTIST_CACHE_FILENAME,
+    PENDING_ARTISTS_FILENAME,
+    LEGACY_TRACK_CATALOG_FILENAME,
+]
+
+# Song lists (the library and playlists) are saved as indices into a catalog of
+# tracks shared by every list in the cache directory, so a track that is in
+# several lists is only stored once. Files from before the catalog hold full
+# song dictionaries under "songs" and can still be loaded. Version 3 lists use
+# the same indices into the old pickled catalog (tracks.pkl), which is copied
+# into the new one the first time it's written.
+SONG_LIST_VERSION = 4
+
+# The catalog starts with CATALOG_MAGIC, a format version byte, then the length
+# and name of the codec. Then come the number of tracks and the size of the
+# (compressed) pickled list of track URIs, the offset of each block in the block
+# section (the last offset is its end), the URIs and the blocks: lists of
+# CATALOG_BLOCK_SIZE consecutive tracks, each pickled and compressed on its own,
+# so loading a list only has to read the blocks it uses. Tracks no list uses are
+# dropped when the catalog is written, leaving None in their block and in the
+# URIs so other indices don't change.
+CATALOG_MAGIC = b"SOLTCAT\0"
+CATALOG_FORMAT_VERSION = 1
+CATALOG_COUNTS = struct.Struct("<QQ")
+
+# Tracks per catalog block. Smaller blocks make loading a short list cheaper,
+# larger ones loading the whole library (pickles share repeated strings, like
+# artist names, within a block).
+CATALOG_BLOCK_SIZE = 32
+
+# Lists using more than this fraction of the catalog's blocks read every block
+# at once instead of seeking to each of them
+CATALOG_READ_ALL_FRACTION = 0.1
+
+# Fields of a song that belong to its place in a list, or that change over time,
+# rather than the track. They're saved with each list, so catalog entries never
+# change once they're added. (Lists saved before version 3 don't have
+# popularity; it comes from the catalog instead.)
+SONG_LIST_FIELDS = ["added_at", "popularity"]
+
+# Cache files start with a header: CACHE_MAGIC, a format version byte, then the
+# length and name of the codec the rest of the file (a pickle) is compressed
+# with. Files without the header are plain pickles from older versions.
+CACHE_MAGIC = b"SOLTIFY\0"
+CACHE_FORMAT_VERSION = 1
+
+# Codecs cache files can be compressed with: <name : (module, package to
+# install)>. Standard library codecs are always available; the others only if
+# installed. Modules are imported the first time they're needed.
+CACHE_CODECS = {
+    "none": (None, None),
+    "zlib": ("zlib", None),
+    "bz2": ("bz2", None),
+    "lzma": ("lzma", None),
+    "lz4": ("lz4.frame", "lz4"),
+    "zstd": ("zstandard", "zstandard"),
+}
+DEFAULT_CACHE_CODEC = "none"
+
+# Codec chosen for each cache directory with set_cache_codec()
+g_cache_codecs = dict()
+
+# The process umask, read once at import since it can only be read by changing
+# it. New cache files get the permissions open() would give them.
+g_umask = os.umask(0)
+os.umask(g_umask)
+
+# Catalogs already loaded by this process, by directory
+g_catalogs = dict()
+g_catalog_lock = threading.Lock()
+
+def available_codecs():
+    """
+    Get the names of the codecs in CACHE_CODECS that can be used here
+    """
+    return [name for name in CACHE_CODECS if _import_codec(name, False) is not None or name == "none"]
+
+def set_cache_codec(directory, codec):
+    """
+    Choose the codec that files saved to a cache directory are compressed with.
+    Files are always loaded with the codec they were saved with.
+    """
+    if not codec in CACHE_CODECS:
+        raise RuntimeError("Unknown cache codec: {}".format(codec))
+    # Fail now rather than at the end of a run if it isn't installed
+    _import_codec(codec, True)
+    g_cache_codecs[os.path.abspath(directory)] = codec
+
+def forget_catalogs():
+    """
+    Forget the track catalogs this process has loaded, so the next load reads
+    them from disk again (e.g. to time it)
+    """
+    with g_catalog_lock:
+        g_catalogs.clear()
 
 def library_cache_exists(directory):
     """
@@ -34,9 +159,8 @@ def save_library(directory, songs, taste, run_time):
     path = os.path.join(directory, LIBRARY_FILENAME)
 
     # Write the file
-    data = {"songs":songs, "taste":taste, "run_time":run_time}
-    file = open(path, "wb")
-    pickle.dump(data, file)
+    data = {"taste":taste, "run_time":run_time}
+    _save_song_list(path, data, songs)
 
 def load_library(directory):
     """
@@ -49,9 +173,8 @@ def load_library(directory):
     if not os.path.exists(path):
         raise RuntimeError("File does not exist: {}".format(path))
 
-    file = open(path, 'rb')
-    data = pickle.load(file)
-    return data["songs"], data["taste"], data["run_time"]
+    songs, data = _load_song_list(path)
+    return songs, data["taste"], data["run_time"]
 
 def save_playlist(directory, playlist_name, songs, playlist_uri):
     """
@@ -67,9 +190,8 @@ def save_playlist(directory, playlist_name, songs, playlist_uri):
     path = os.path.join(directory, filename)
 
     # Write the file
-    data = {"songs":songs, "playlist_uri":playlist_uri}
-    file = open(path, "wb")
-    pickle.dump(data, file)
+    data = {"playlist_uri":playlist_uri}
+    _save_song_list(path, data, songs)
 
 
 def load_playlist(directory, playlist_name):
@@ -88,9 +210,8 @@ def load_playlist(directory, playlist_name):
     if not os.path.exists(path):
         raise RuntimeError("File does not exist: {}".format(path))
 
-    file = open(path, 'rb')
-    data = pickle.load(file)
-    return data["songs"], data["playlist_uri"]
+    songs, data = _load_song_list(path)
+    return songs, data["playlist_uri"]
 
 def release_lists_exist(directory):
     """
@@ -119,6 +240,11 @@ def save_taste_profile(directory, taste):
     """
     Save taste profile to .csv file for viewing
     """
+
+    # Make sure the output directory exists
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
     path = os.path.join(directory, TASTE_PROFILE_FILENAME)
     with open(path, "w", encoding="utf-8", newline="") as file:
         writer = csv.writer(file)
@@ -132,6 +258,88 @@ def save_taste_profile(directory, taste):
             ]
             writer.writerow(row)
 
+def save_checkpoint(directory, checkpoint):
+    """
+    Save the state of an in-progress run so that it can be resumed later if the
+    run is interrupted. The file is replaced atomically, so a crash while saving
+    leaves the previous checkpoint intact.
+    """
+
+    # Make sure the output directory exists
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    path = os.path.join(directory, CHECKPOINT_FILENAME)
+    _atomic_dump(path, checkpoint)
+
+def load_checkpoint(directory):
+    """
+    Load the state of an interrupted run that was saved by save_checkpoint().
+
+    Returns None if there is no checkpoint in this directory
+    """
+    path = os.path.join(directory, CHECKPOINT_FILENAME)
+    if not os.path.exists(path):
+        return None
+
+    return _load(path)
+
+def clear_checkpoint(directory):
+    """
+    Delete the checkpoint file once a run has finished successfully
+    """
+    path = os.path.join(directory, CHECKPOINT_FILENAME)
+    if os.path.exists(path):
+        os.remove(path)
+
+def save_artist_cache(directory, artist_cache):
+    """
+    Save an ArtistCache shared between accounts to a file
+    """
+
+    # Make sure the output directory exists
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    path = os.path.join(directory, ARTIST_CACHE_FILENAME)
+    _atomic_dump(path, artist_cache)
+
+def load_artist_cache(directory):
+    """
+    Load an ArtistCache that was saved by save_artist_cache().
+
+    Returns None if there is no saved cache in this directory
+    """
+    path = os.path.join(directory, ARTIST_CACHE_FILENAME)
+    if not os.path.exists(path):
+        return None
+
+    return _load(path)
+
+def save_pending_artists(directory, artist_ids):
+    """
+    Save the ids of artists whose releases weren't searched because a run ran
+    out of budget, so the next run can search them first
+    """
+
+    # Make sure the output directory exists
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    path = os.path.join(directory, PENDING_ARTISTS_FILENAME)
+    _atomic_dump(path, artist_ids)
+
+def load_pending_artists(directory):
+    """
+    Load the artist ids saved by save_pending_artists(), or an empty list if
+    there are none
+    """
+    path = os.path.join(directory, PENDING_ARTISTS_FILENAME)
+    if not os.path.exists(path):
+        return []
+
+    return _load(path)
+
 ################################################################################
 # Private functions
 ################################################################################
@@ -153,3 +361,416 @@ def _playlist_name_to_filename(playlist_name):
     filename += ".pkl"
 
     return filename
+
+def _save_song_list(path, data, songs):
+    """
+    Save a song list (the library or a playlist) to a file along with data (a
+    dict of other values to save with it). The list is saved as the catalog
+    index of each song and the fields in SONG_LIST_FIELDS. New tracks are added
+    to the directory's track catalog first, so a saved list never refers to
+    tracks that aren't in it.
+    """
+    directory = os.path.dirname(path)
+    data = dict(data, version=SONG_LIST_VERSION)
+    for field in SONG_LIST_FIELDS:
+        data[field] = [song.get(field) for song in songs]
+
+    # Another process may change the catalog at any time, and rewriting it drops
+    # the tracks no saved list uses, so hold the file lock until the list is
+    # saved too
+    with g_catalog_lock, _catalog_file_lock(directory):
+        catalog = _load_catalog(directory)
+        index = _catalog_index(directory, catalog)
+        new_tracks = dict()
+        for song in songs:
+            if not song["uri"] in index and not song["uri"] in new_tracks:
+                new_tracks[song["uri"]] = {key: value for key, value in song.items()
+                                           if not key in SONG_LIST_FIELDS}
+        if new_tracks:
+            used = _used_tracks(directory, path)
+            if used is not None:
+                used.update(index[song["uri"]] for song in songs if song["uri"] in index)
+            catalog = _write_catalog(directory, catalog, used, list(new_tracks.values()))
+            index = _catalog_index(directory, catalog)
+        data["tracks"] = array("L", (index[song["uri"]] for song in songs))
+        _atomic_dump(path, data)
+
+def _load_song_list(path):
+    """
+    Load a song list saved by _save_song_list(), or from a file saved before the
+    track catalog existed. Only the tracks the list uses are read from the
+    catalog.
+
+    Returns the list of songs and the rest of the saved data
+    """
+    directory = os.path.dirname(path)
+    with g_catalog_lock, _catalog_file_lock(directory):
+        data = _load(path)
+        if "songs" in data:
+            return data["songs"], data
+        tracks = _catalog_tracks(directory, _load_catalog(directory), data["tracks"])
+
+    fields = [(field, data[field]) for field in SONG_LIST_FIELDS if field in data]
+    songs = []
+    for position, i in enumerate(data["tracks"]):
+        song = dict(tracks[i])
+        for field, values in fields:
+            song[field] = values[position]
+        songs.append(song)
+    return songs, data
+
+def _load_catalog(directory):
+    """
+    Get the track catalog of a directory, loading it if it hasn't been loaded
+    yet or was changed on disk (e.g. by another tool) since. Only the offsets of
+    the blocks are read here; the URIs and tracks are read when they're needed.
+    Must be called with the catalog lock held.
+    """
+    path = os.path.join(directory, TRACK_CATALOG_FILENAME)
+    stamp = _file_stamp(path)
+    catalog = g_catalogs.get(directory)
+    if catalog is not None and catalog["stamp"] == stamp:
+        return catalog
+
+    if stamp is None:
+        catalog = _load_legacy_catalog(directory)
+    else:
+        with open(path, "rb") as file:
+            header = file.read(len(CATALOG_MAGIC) + 2)
+            if not header.startswith(CATALOG_MAGIC):
+                raise RuntimeError("{} is not a track catalog".format(path))
+            if header[-2] > CATALOG_FORMAT_VERSION:
+                raise RuntimeError("{} was saved by a newer version of Soltify".format(path))
+            codec = file.read(header[-1]).decode("ascii")
+            if not codec in CACHE_CODECS:
+                raise RuntimeError("{} was saved with unknown codec: {}".format(path, codec))
+            count, uris_size = CATALOG_COUNTS.unpack(file.read(CATALOG_COUNTS.size))
+            offsets = array("Q")
+            num_blocks = -(-count // CATALOG_BLOCK_SIZE)
+            offsets.frombytes(file.read(offsets.itemsize * (num_blocks + 1)))
+            if sys.byteorder == "big":
+                offsets.byteswap()
+            uris_start = file.tell()
+        catalog = {
+            "codec": codec,
+            "count": count,
+            "offsets": offsets,
+            "uris_start": uris_start,
+            "records_start": uris_start + uris_size,
+            "uris": None,
+            "index": None,
+            "tracks": dict(),
+        }
+    catalog["stamp"] = stamp
+    g_catalogs[directory] = catalog
+    return catalog
+
+def _load_legacy_catalog(directory):
+    """
+    Load the pickled track catalog used by version 3 song lists, if there is
+    one. It has no offsets, so every track is loaded.
+    """
+    path = os.path.join(directory, LEGACY_TRACK_CATALOG_FILENAME)
+    tracks = []
+    if os.path.exists(path):
+        tracks = _load(path)["tracks"]
+    return {
+        "codec": None,
+        "count": len(tracks),
+        "offsets": None,
+        "uris": [track["uri"] for track in tracks],
+        "index": None,
+        "tracks": dict(enumerate(tracks)),
+    }
+
+def _catalog_uris(directory, catalog):
+    """
+    Get the URI of each track in a catalog (None for dropped tracks), reading
+    them if they haven't been read yet
+    """
+    if catalog["uris"] is None:
+        path = os.path.join(directory, TRACK_CATALOG_FILENAME)
+        with open(path, "rb") as file:
+            file.seek(catalog["uris_start"])
+            payload = file.read(catalog["records_start"] - catalog["uris_start"])
+        catalog["uris"] = pickle.loads(_decompress(catalog["codec"], payload))
+    return catalog["uris"]
+
+def _catalog_index(directory, catalog):
+    """
+    Get a dictionary of the catalog index of each track URI
+    """
+    if catalog["index"] is None:
+        uris = _catalog_uris(directory, catalog)
+        catalog["index"] = {uri: i for i, uri in enumerate(uris) if uri is not None}
+    return catalog["index"]
+
+def _catalog_tracks(directory, catalog, indices):
+    """
+    Get the tracks at some indices of a catalog, as a dictionary of index :
+    track. The blocks of tracks that haven't been read yet are read from the
+    file.
+    """
+    tracks = catalog["tracks"]
+    missing = set(i for i in indices if not i in tracks)
+    if not missing:
+        return tracks
+
+    offsets = catalog["offsets"]
+    if offsets is not None:
+        blocks = sorted(set(i // CATALOG_BLOCK_SIZE for i in missing if i < catalog["count"]))
+        path = os.path.join(directory, TRACK_CATALOG_FILENAME)
+        with open(path, "rb") as file:
+            records = None
+            if len(blocks) > (len(offsets) - 1) * CATALOG_READ_ALL_FRACTION:
+                file.seek(catalog["records_start"])
+                records = memoryview(file.read())
+            for block in blocks:
+                if records is not None:
+                    payload = records[offsets[block]:offsets[block + 1]]
+                else:
+                    file.seek(catalog["records_start"] + offsets[block])
+                    payload = file.read(offsets[block + 1] - offsets[block])
+                first = block * CATALOG_BLOCK_SIZE
+                for i, track in enumerate(pickle.loads(_decompress(catalog["codec"], payload)), first):
+                    if track is not None:
+                        tracks[i] = track
+
+    for i in missing:
+        if not i in tracks:
+            raise RuntimeError("Track {} is missing from the track catalog in {}".format(i, directory))
+    return tracks
+
+def _write_catalog(directory, catalog, used, new_tracks):
+    """
+    Rewrite the track catalog of a directory with new tracks added to the end,
+    dropping the tracks whose indices aren't in used (unless used is None).
+    Indices of the tracks that are kept don't change. Returns the new catalog.
+    """
+    codec = _directory_codec(directory)
+    uris = list(_catalog_uris(directory, catalog))
+    old_offsets = catalog["offsets"]
+    old_records = None
+    if old_offsets is not None:
+        path = os.path.join(directory, TRACK_CATALOG_FILENAME)
+        with open(path, "rb") as file:
+            file.seek(catalog["records_start"])
+            old_records = memoryview(file.read())
+
+    # Blocks that lose or gain tracks are pickled again (as is every block of
+    # the legacy catalog). The others are copied as they are unless the codec
+    # changed.
+    changed = set()
+    for i, uri in enumerate(uris):
+        if uri is not None and used is not None and not i in used:
+            uris[i] = None
+            changed.add(i // CATALOG_BLOCK_SIZE)
+    tracks = {i: track for i, track in catalog["tracks"].items() if uris[i] is not None}
+    for track in new_tracks:
+        changed.add(len(uris) // CATALOG_BLOCK_SIZE)
+        tracks[len(uris)] = track
+        uris.append(track["uri"])
+
+    records = []
+    for block in range(-(-len(uris) // CATALOG_BLOCK_SIZE)):
+        if old_records is not None and not block in changed:
+            record = old_records[old_offsets[block]:old_offsets[block + 1]]
+            if codec != catalog["codec"]:
+                record = _compress(codec, _decompress(catalog["codec"], record))
+        else:
+            first = block * CATALOG_BLOCK_SIZE
+            indices = range(first, min(first + CATALOG_BLOCK_SIZE, len(uris)))
+            used_indices = [i for i in indices if uris[i] is not None]
+            _catalog_tracks(directory, catalog, [i for i in used_indices if not i in tracks])
+            block_tracks = [tracks.get(i, catalog["tracks"].get(i)) if uris[i] is not None else None
+                            for i in indices]
+            record = _compress(codec, pickle.dumps(block_tracks, protocol=pickle.HIGHEST_PROTOCOL))
+        records.append(record)
+
+    offsets = array("Q", [0])
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    file_offsets = array("Q", offsets)
+    if sys.byteorder == "big":
+        file_offsets.byteswap()
+    uris_payload = _compress(codec, pickle.dumps(uris, protocol=pickle.HIGHEST_PROTOCOL))
+    name = codec.encode("ascii")
+    header = CATALOG_MAGIC + bytes([CATALOG_FORMAT_VERSION, len(name)]) + name
+    counts = CATALOG_COUNTS.pack(len(uris), len(uris_payload))
+    path = os.path.join(directory, TRACK_CATALOG_FILENAME)
+    _atomic_write(path, [header, counts, file_offsets.tobytes(), uris_payload, b"".join(records)])
+
+    # Version 3 lists use the same indices, so the legacy catalog isn't needed
+    # once it's been copied
+    legacy_path = os.path.join(directory, LEGACY_TRACK_CATALOG_FILENAME)
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+    uris_start = len(header) + len(counts) + offsets.itemsize * len(offsets)
+    catalog = {
+        "codec": codec,
+        "count": len(uris),
+        "offsets": offsets,
+        "uris_start": uris_start,
+        "records_start": uris_start + len(uris_payload),
+        "uris": uris,
+        "index": None,
+        "tracks": tracks,
+        "stamp": _file_stamp(path),
+    }
+    g_catalogs[directory] = catalog
+    return catalog
+
+def _used_tracks(directory, skip_path):
+    """
+    Get the set of catalog indices used by the song lists saved in a directory,
+    other than the one at skip_path (which is about to be replaced). Returns
+    None if a list couldn't be read, since then any track may still be used.
+    """
+    used = set()
+    for filename in os.listdir(directory or "."):
+        path = os.path.join(directory, filename)
+        if (not filename.endswith(".pkl") or filename in NON_SONG_LIST_FILENAMES
+                or os.path.abspath(path) == os.path.abspath(skip_path)):
+            continue
+        try:
+            data = _load(path)
+        except Exception:
+            return None
+        if isinstance(data, dict) and isinstance(data.get("tracks"), array):
+            used.update(data["tracks"])
+    return used
+
+@contextlib.contextmanager
+def _catalog_file_lock(directory):
+    """
+    Hold an exclusive lock on a directory's track catalog, shared with other
+    processes, while the block runs
+    """
+    path = os.path.join(directory, TRACK_CATALOG_LOCK_FILENAME)
+    with open(path, "a+b") as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _file_stamp(path):
+    """
+    Get a value that changes whenever a file is rewritten, or None if it
+    doesn't exist
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _atomic_dump(path, data):
+    """
+    Pickle data to a file (compressed with the codec chosen for its directory)
+    without ever leaving a partially written file behind
+    """
+    codec = _directory_codec(os.path.dirname(path))
+    payload = _compress(codec, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+    name = codec.encode("ascii")
+    header = CACHE_MAGIC + bytes([CACHE_FORMAT_VERSION, len(name)]) + name
+    _atomic_write(path, [header, payload])
+
+def _atomic_write(path, chunks):
+    """
+    Write chunks of bytes to a file without ever leaving a partially written
+    file behind.
+
+    The data is written to a temporary file in the same directory, then renamed
+    over the destination, which is atomic on both Windows and POSIX.
+    """
+    directory = os.path.dirname(path) or "."
+
+    # mkstemp makes files only the owner can read, so give the file the
+    # permissions of the one it replaces (or of a new file) instead
+    if os.path.exists(path):
+        mode = os.stat(path).st_mode & 0o777
+    else:
+        mode = 0o666 & ~g_umask
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def _load(path):
+    """
+    Load data saved by _atomic_dump(), or a plain pickle saved by an older
+    version
+    """
+    with open(path, 'rb') as file:
+        contents = file.read()
+    if not contents.startswith(CACHE_MAGIC):
+        return pickle.loads(contents)
+
+    start = len(CACHE_MAGIC)
+    version = contents[start]
+    if version > CACHE_FORMAT_VERSION:
+        raise RuntimeError("{} was saved by a newer version of Soltify".format(path))
+    name_length = contents[start + 1]
+    codec = contents[start + 2:start + 2 + name_length].decode("ascii")
+    if not codec in CACHE_CODECS:
+        raise RuntimeError("{} was saved with unknown codec: {}".format(path, codec))
+    payload = memoryview(contents)[start + 2 + name_length:]
+    return pickle.loads(_decompress(codec, payload))
+
+def _directory_codec(directory):
+    """
+    Get the codec chosen with set_cache_codec() for a directory
+    """
+    return g_cache_codecs.get(os.path.abspath(directory or "."), DEFAULT_CACHE_CODEC)
+
+def _compress(codec, payload):
+    """
+    Compress bytes with a codec in CACHE_CODECS
+    """
+    module = _import_codec(codec, True)
+    if module is None:
+        return payload
+    return module.compress(payload)
+
+def _decompress(codec, payload):
+    """
+    Decompress bytes compressed by _compress() with the same codec
+    """
+    module = _import_codec(codec, True)
+    if module is None:
+        return payload
+    return module.decompress(payload)
+
+def _import_codec(codec, required):
+    """
+    Import the module of a codec in CACHE_CODECS. Returns None for "none", or
+    if the module isn't installed and required=False.
+    """
+    module_name, package = CACHE_CODECS[codec]
+    if module_name is None:
+        return None
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        if required:
+            raise RuntimeError("Cache codec {} needs a library that isn't installed (pip install {})".format(
+                codec, package))
+        return None
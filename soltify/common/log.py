@@ -4,29 +4,57 @@ Soltify/Common/Log
 Helper functions for printing messages to the console
 """
 import ctypes
+import os
 import shutil
 import sys
+import threading
 import time
 
-# Definitions used to change console output color
+# Definitions used to change console output color on Windows
 STD_OUTPUT_HANDLE = -11
 
 COLOR_CODE_DEFAULT = 0x07  # White
 COLOR_CODE_WARNING = 0x0E  # Light Yellow
 COLOR_CODE_ERROR = 0x0C # Red
 
+# ANSI escape codes for the same colors on other consoles
+ANSI_COLORS = {
+    COLOR_CODE_DEFAULT: "\033[0m",
+    COLOR_CODE_WARNING: "\033[93m",
+    COLOR_CODE_ERROR: "\033[91m",
+}
+
 PROGRESS_BAR_FILL = '█'
 
-g_start_time = time.time()
+# Progress bars are redrawn at most this many times per second (the first and
+# last update of each task are always drawn)
+MAX_RENDERS_PER_SECOND = 10.0
+
+# When stdout is not a console (e.g. redirected to a log file), a plain line is
+# printed for each task at most once per this many seconds
+PLAIN_PROGRESS_INTERVAL = 5.0
+
+# Label used for progress updates that don't name a task
+DEFAULT_TASK = "Progress"
+
+g_tasks = dict()
+g_lines_drawn = 0
+g_last_render_time = 0.0
+g_progress_lock = threading.Lock()
 
 def _print_colored(text, color_code):
     """
     Print text in a specified color
     """
-    handle = ctypes.windll.kernel32.GetStdHandle(STD_OUTPUT_HANDLE)
-    ctypes.windll.kernel32.SetConsoleTextAttribute(handle, color_code)
-    print(text)
-    ctypes.windll.kernel32.SetConsoleTextAttribute(handle, COLOR_CODE_DEFAULT)
+    if not sys.stdout.isatty():
+        print(text)
+    elif os.name == "nt" and hasattr(ctypes, "windll"):
+        handle = ctypes.windll.kernel32.GetStdHandle(STD_OUTPUT_HANDLE)
+        ctypes.windll.kernel32.SetConsoleTextAttribute(handle, color_code)
+        print(text)
+        ctypes.windll.kernel32.SetConsoleTextAttribute(handle, COLOR_CODE_DEFAULT)
+    else:
+        print(ANSI_COLORS[color_code] + text + ANSI_COLORS[COLOR_CODE_DEFAULT])
 
 def warning(msg):
     """
@@ -40,31 +68,48 @@ def error(msg):
     """
     _print_colored(f"ERROR: {msg}", COLOR_CODE_ERROR)
 
-def show_progress(progress, total):
+def show_progress(progress, total, task=None):
     """
-    Print a progress bar to console
+    Print a progress bar to console, with the throughput and estimated time
+    remaining.
+
+    This is cheap to call for every item: the bar is only redrawn a limited
+    number of times per second. Several tasks (e.g. concurrent workers) can
+    show progress at once by passing a different task name for each; each one
+    gets its own bar until all of them have finished.
     """
-    global g_start_time
+    global g_last_render_time, g_lines_drawn
 
-    if progress == 0:
-        g_start_time = time.time()
+    if task is None:
+        task = DEFAULT_TASK
+    now = time.time()
 
-    # The progress bar is the console width minus the number of characters of text in it
-    # "Progress: [" = 11
-    # "] 100.00% elapsed time: 00:00" = 29
-    bar_width = shutil.get_terminal_size()[0] - (11 + 29 + 1)
-    percentage = progress / total * 100.0
-    progress_length = int(bar_width * progress / total)
-    bar = PROGRESS_BAR_FILL * progress_length + ' ' * (bar_width - progress_length)
+    with g_progress_lock:
+        if progress == 0 or not task in g_tasks:
+            g_tasks[task] = {"start": now, "last_plain": 0.0}
+        entry = g_tasks[task]
+        entry["progress"] = progress
+        entry["total"] = total
+        finished = progress >= total
 
-    elapsed = time.time() - g_start_time
-    minutes = int(elapsed / 60)
-    seconds = int(elapsed % 60)
-    sys.stdout.write(f'\rProgress: [{bar}] {percentage:.2f}%  elapsed time: {minutes}:{seconds:02d}')
-    sys.stdout.flush()
-    # Add new line when we hit 100%
-    if progress == total:
-        print()
+        if not sys.stdout.isatty():
+            # Not a console, so just log a line every so often
+            if progress == 0 or finished or now - entry["last_plain"] >= PLAIN_PROGRESS_INTERVAL:
+                entry["last_plain"] = now
+                print(_format_progress(task, entry, now, None))
+            if finished:
+                del g_tasks[task]
+            return
+
+        if progress == 0 or finished or now - g_last_render_time >= 1.0 / MAX_RENDERS_PER_SECOND:
+            g_last_render_time = now
+            _render_bars(now)
+
+        # Add new line when every task hits 100%
+        if finished and all(e["progress"] >= e["total"] for e in g_tasks.values()):
+            print()
+            g_tasks.clear()
+            g_lines_drawn = 0
 
 def prompt_user(text):
     """
@@ -73,3 +118,63 @@ def prompt_user(text):
     prompt = f"{text} [y/N] "
     user_response = input(prompt).strip().lower()
     return user_response == "y"
+
+################################################################################
+# Private Functions
+################################################################################
+def _render_bars(now):
+    """
+    Redraw the bars of all tasks in place. Must be called with the progress
+    lock held.
+    """
+    global g_lines_drawn
+
+    width = shutil.get_terminal_size()[0]
+    lines = [_format_progress(task, entry, now, width) for task, entry in g_tasks.items()]
+
+    # Move the cursor back to the start of the first bar drawn last time
+    output = '\r'
+    if g_lines_drawn > 1:
+        output += f'\033[{g_lines_drawn - 1}A'
+    # Clear the rest of each line in case it was longer last time
+    output += '\n'.join(line + '\033[K' for line in lines)
+    sys.stdout.write(output)
+    sys.stdout.flush()
+    g_lines_drawn = len(lines)
+
+def _format_progress(task, entry, now, width):
+    """
+    Format one task's progress as a single line. If width is given, it includes
+    a bar that fills the line; otherwise it's a plain message for log files.
+    """
+    progress = entry["progress"]
+    total = entry["total"]
+    fraction = min(progress / total, 1.0) if total else 1.0
+    elapsed = now - entry["start"]
+    rate = progress / elapsed if elapsed > 0 else 0.0
+    if fraction >= 1.0:
+        eta = "0:00"
+    elif rate > 0:
+        eta = _format_time((total - progress) / rate)
+    else:
+        eta = "--:--"
+    stats = f"{fraction * 100.0:.2f}% {rate:.1f}/s elapsed: {_format_time(elapsed)} ETA: {eta}"
+
+    if width is None:
+        return f"{task}: {progress}/{total} {stats}"
+
+    # The progress bar is the console width minus the number of characters of text in it
+    label = f"{task}: ["
+    suffix = f"] {stats}"
+    bar_width = max(width - len(label) - len(suffix) - 1, 0)
+    progress_length = int(bar_width * fraction)
+    bar = PROGRESS_BAR_FILL * progress_length + ' ' * (bar_width - progress_length)
+    return label + bar + suffix
+
+def _format_time(seconds):
+    """
+    Format a number of seconds as minutes:seconds
+    """
+    minutes = int(seconds / 60)
+    seconds = int(seconds % 60)
+    return f"{minutes}:{seconds:02d}"
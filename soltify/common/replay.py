@@ -0,0 +1,132 @@
+"""
+Soltify/Common/Replay
+
+Helper classes that record the responses a Spotify account gives us and replay
+them later without a network connection, with an optional simulated network
+latency. Either client can be swapped in for the spotipy client used by the
+Spotify class (the Spotify.sp attribute).
+"""
+import json
+import os
+import pickle
+import random
+import threading
+import time
+
+# Functions that change the account. Their arguments usually differ between
+# runs (e.g. a new shuffle order), so they don't need a recorded response.
+WRITE_FUNCTIONS = ["playlist_add_items", "playlist_replace_items"]
+
+class LatencyModel:
+    """
+    Simulated network latency for each request: a fixed round trip time plus
+    a per-KB transfer time and some random jitter.
+
+    If sleep=False, no time is actually spent waiting. The simulated time is
+    just added up in network_time so that benchmarks of big libraries finish
+    quickly but can still report a realistic wall time. It is also added up for
+    each thread, since requests made by different threads would have waited
+    on the network at the same time.
+    """
+    def __init__(self, round_trip_ms=0.0, per_kb_ms=0.0, jitter_ms=0.0, sleep=False, seed=0):
+        self.round_trip_ms = round_trip_ms
+        self.per_kb_ms = per_kb_ms
+        self.jitter_ms = jitter_ms
+        self.sleep = sleep
+        self.network_time = 0.0
+        self.thread_network_time = dict()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def delay(self, num_bytes):
+        """
+        Simulate the latency of one request with a response of num_bytes
+        """
+        ms = self.round_trip_ms + self.per_kb_ms * num_bytes / 1024.0
+        with self.lock:
+            if self.jitter_ms:
+                ms += self.random.uniform(0, self.jitter_ms)
+            self.network_time += ms / 1000.0
+            thread = threading.get_ident()
+            self.thread_network_time[thread] = self.thread_network_time.get(thread, 0.0) + ms / 1000.0
+        if self.sleep:
+            time.sleep(ms / 1000.0)
+
+    def thread_times(self):
+        """
+        Get a copy of the simulated network time of each thread so far, as a
+        dictionary of <thread id : seconds>
+        """
+        with self.lock:
+            return dict(self.thread_network_time)
+
+class RecordingClient:
+    """
+    Wraps a spotipy client, passing every call through and saving its response
+    so that it can be played back later with ReplayClient
+    """
+    def __init__(self, client):
+        self.client = client
+        self.responses = dict()
+
+    def __getattr__(self, name):
+        func = getattr(self.client, name)
+        if not callable(func):
+            return func
+
+        def record(*args, **kwargs):
+            result = func(*args, **kwargs)
+            self.responses[_request_key(name, args, kwargs)] = result
+            return result
+        return record
+
+    def save(self, path):
+        """
+        Save all recorded responses to a file
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(path, "wb") as file:
+            pickle.dump(self.responses, file)
+
+class ReplayClient:
+    """
+    Stands in for a spotipy client by answering each call with the response
+    saved by RecordingClient for the same call
+    """
+    def __init__(self, path, latency=None):
+        with open(path, "rb") as file:
+            self.responses = pickle.load(file)
+        if latency is None:
+            latency = LatencyModel()
+        self.latency = latency
+        self.request_count = 0
+        self.sizes = dict()
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        def replay(*args, **kwargs):
+            key = _request_key(name, args, kwargs)
+            with self.lock:
+                self.request_count += 1
+            if key in self.responses:
+                result = self.responses[key]
+            elif name in WRITE_FUNCTIONS:
+                result = {"snapshot_id": "replay"}
+            else:
+                raise RuntimeError("No recorded response for {}".format(key))
+            if not key in self.sizes:
+                self.sizes[key] = len(json.dumps(result, default=str))
+            self.latency.delay(self.sizes[key])
+            return result
+        return replay
+
+def _request_key(name, args, kwargs):
+    """
+    Build a key that identifies a call by its function name and arguments.
+    Pages fetched with next() are identified by their URL.
+    """
+    if name == "next":
+        args = [args[0]["next"]]
+    return json.dumps([name, args, sorted(kwargs.items())], default=str)
@@ -0,0 +1,169 @@
+"""
+Soltify/Common/Song Table
+
+Helper class, SongTable, that holds a list of songs along with indexes for
+looking songs up by artist, uri, release date or date added without scanning
+the whole list
+"""
+import bisect
+
+# Keys songs can be grouped by without passing a key function to group()
+GROUP_KEYS = {
+    "uri": lambda song: song["uri"],
+    "artist_id": lambda song: song["artist_id"],
+}
+
+# Keys songs can be kept sorted by, for range queries
+SORT_KEYS = {
+    "release_date": lambda song: song["release_date"],
+    "added_at": lambda song: song["added_at"],
+}
+
+# When more than this many songs are added at once, sorted indexes are rebuilt
+# instead of inserting each song
+REBUILD_THRESHOLD = 64
+
+class SongTable:
+    """
+    A list of songs (dictionaries, as from Spotify.load_library()) with
+    secondary indexes. Each index is built the first time it is used, then kept
+    up to date as songs are added, so a table can be queried many times for
+    the cost of building each index once.
+
+    It can be iterated over, indexed and passed anywhere a list of songs is
+    expected. The lists returned by queries belong to the table and must not be
+    changed.
+    """
+    def __init__(self, songs=None):
+        self.songs = []
+        # <name : (key function, <value : [songs]>)>
+        self.groups = dict()
+        # <name : (key function, sorted keys, songs in the same order)>
+        self.sorted = dict()
+        if songs:
+            self.extend(songs)
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __iter__(self):
+        return iter(self.songs)
+
+    def __getitem__(self, i):
+        return self.songs[i]
+
+    def append(self, song):
+        """
+        Add a song to the end of the table
+        """
+        self.songs.append(song)
+        for key_func, groups in self.groups.values():
+            groups.setdefault(key_func(song), []).append(song)
+        for key_func, keys, songs in self.sorted.values():
+            key = key_func(song)
+            i = bisect.bisect_right(keys, key)
+            keys.insert(i, key)
+            songs.insert(i, song)
+
+    def extend(self, songs):
+        """
+        Add several songs to the end of the table
+        """
+        songs = list(songs)
+        if len(songs) <= REBUILD_THRESHOLD:
+            for song in songs:
+                self.append(song)
+            return
+        self.songs.extend(songs)
+        for key_func, groups in self.groups.values():
+            for song in songs:
+                groups.setdefault(key_func(song), []).append(song)
+        for name in list(self.sorted):
+            self._build_sorted(name, self.sorted[name][0])
+
+    def remove_uris(self, uris):
+        """
+        Remove every song whose uri is in a set of uris
+        """
+        self.songs = [song for song in self.songs if not song["uri"] in uris]
+        # Removing is rare, so just rebuild the indexes that were in use
+        for name, (key_func, groups) in list(self.groups.items()):
+            self._build_group(name, key_func)
+        for name, (key_func, keys, songs) in list(self.sorted.items()):
+            self._build_sorted(name, key_func)
+
+    def group(self, name, key_func=None):
+        """
+        Get a dictionary of <value : [songs]> grouping the songs by a key. name
+        is one of GROUP_KEYS, or any name for a key_func that is passed in.
+        """
+        if not name in self.groups:
+            self._build_group(name, key_func or GROUP_KEYS[name])
+        return self.groups[name][1]
+
+    def contains_uri(self, uri):
+        """
+        Check if a song with this uri is in the table
+        """
+        return uri in self.group("uri")
+
+    def sorted_by(self, name, reverse=False):
+        """
+        Get the songs sorted by one of SORT_KEYS. Songs with the same key stay
+        in the order they were added, even if reverse=True.
+        """
+        key_func, keys, songs = self._get_sorted(name)
+        if not reverse:
+            return list(songs)
+        result = []
+        end = len(keys)
+        while end > 0:
+            start = bisect.bisect_left(keys, keys[end - 1], 0, end)
+            result.extend(songs[start:end])
+            end = start
+        return result
+
+    def released_since(self, min_release_date):
+        """
+        Get the songs released on or after a date, oldest first
+        """
+        return self._since("release_date", min_release_date)
+
+    def artist_counts(self, min_release_date):
+        """
+        Count the songs by each artist released on or after a date. Returns a
+        dictionary of <artist_id : count> pairs and a second dictionary of
+        <artist_id : name> identifying each artist.
+        """
+        counts = dict()
+        names = dict()
+        for song in self.released_since(min_release_date):
+            artist_id = song["artist_id"]
+            if artist_id in counts:
+                counts[artist_id] += 1
+            else:
+                counts[artist_id] = 1
+                names[artist_id] = song["artist"]
+        return counts, names
+
+    ############################################################################
+    # Private Functions
+    ############################################################################
+    def _build_group(self, name, key_func):
+        groups = dict()
+        for song in self.songs:
+            groups.setdefault(key_func(song), []).append(song)
+        self.groups[name] = (key_func, groups)
+
+    def _build_sorted(self, name, key_func):
+        songs = sorted(self.songs, key=key_func)
+        self.sorted[name] = (key_func, [key_func(song) for song in songs], songs)
+
+    def _get_sorted(self, name):
+        if not name in self.sorted:
+            self._build_sorted(name, SORT_KEYS[name])
+        return self.sorted[name]
+
+    def _since(self, name, minimum):
+        key_func, keys, songs = self._get_sorted(name)
+        return songs[bisect.bisect_left(keys, minimum):]
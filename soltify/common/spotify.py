@@ -3,32 +3,390 @@ Soltify/Common/Spotify
 
 Helper class, Spotify, that handles communication with a Spotify account
 """
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
+import collections
+import fnmatch
+import threading
+import time
 
 from datetime import datetime
 
+from . import api_stats
+from . import song_table
 from . import log
 from . import taste_profile
 
 SPOTIFY_SCOPE = "user-library-read playlist-read-private playlist-modify-private"
 
+# Default request budget shared by all calls made through one rate limiter.
+# Spotify does not publish its limits (they are enforced over a rolling 30
+# second window), so these start conservative and adapt: the request rate grows
+# by REQUESTS_PER_SECOND_INCREASE after each second's worth of successful
+# requests up to MAX_REQUESTS_PER_SECOND, and halves (down to
+# MIN_REQUESTS_PER_SECOND) whenever we get throttled. Concurrency adapts the
+# same way.
+DEFAULT_REQUESTS_PER_SECOND = 10.0
+MIN_REQUESTS_PER_SECOND = 1.0
+MAX_REQUESTS_PER_SECOND = 30.0
+REQUESTS_PER_SECOND_INCREASE = 1.0
+DEFAULT_BURST = 20
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+
+# How many times a throttled (HTTP 429) request is retried before giving up
+MAX_THROTTLE_RETRIES = 8
+
+# Seconds to wait after a 429 if the response has no Retry-After header
+DEFAULT_RETRY_AFTER = 1.0
+
+# Window (in seconds) used to measure current throughput
+THROUGHPUT_WINDOW = 10.0
+
+# Number of saved songs read per request by load_library() (spotipy's default)
+LIBRARY_PAGE_SIZE = 20
+
+# Number of saved songs read per request when reconcile_library() re-reads a
+# region of the library that changed (Spotify's maximum page size)
+RECONCILE_PAGE_SIZE = 50
+
+# Album groups searched for new releases, in the order Spotify lists them.
+# Releases an artist appears on are counted as albums.
+RELEASE_GROUPS = ["album", "single", "appears_on"]
+
+# Album search that lists releases from the last two weeks, read along with
+# the new release listings by get_release_feed()
+NEW_RELEASE_QUERY = "tag:new"
+
+# Spotify won't return search results past this many
+MAX_SEARCH_RESULTS = 1000
+
+# Characters that make a playlist name passed to find_playlists() a pattern
+WILDCARD_CHARS = "*?["
+
+def is_pattern(name):
+    """
+    Check if a playlist name passed to Spotify.find_playlists() contains any
+    wildcards
+    """
+    return any(c in name for c in WILDCARD_CHARS)
+
+def rate_limited_seconds(requests, rate=DEFAULT_REQUESTS_PER_SECOND, burst=DEFAULT_BURST,
+                         max_rate=MAX_REQUESTS_PER_SECOND):
+    """
+    Estimate how many seconds a new RateLimiter takes to allow a number of
+    requests if none of them are throttled, as its rate grows towards max_rate
+    """
+    seconds = 0.0
+    requests -= burst
+    while requests > 0 and rate < max_rate:
+        batch = min(requests, max(1, int(rate)))
+        seconds += batch / rate
+        requests -= batch
+        rate = min(max_rate, rate + REQUESTS_PER_SECOND_INCREASE)
+    return seconds + max(0, requests) / rate
+
+class TokenBucket:
+    """
+    Token bucket that allows an average of `rate` requests per second with
+    bursts of up to `capacity` requests. The rate grows by
+    REQUESTS_PER_SECOND_INCREASE after each second's worth of successful
+    requests (additive increase) and is halved whenever we get throttled
+    (multiplicative decrease), staying between min_rate and max_rate.
+    """
+    def __init__(self, rate, capacity, min_rate=MIN_REQUESTS_PER_SECOND, max_rate=MAX_REQUESTS_PER_SECOND):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max(rate, max_rate)
+        self.capacity = capacity
+        self.tokens = capacity
+        self.successes = 0
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take one token, blocking until one is available
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        """
+        Throw away all saved up tokens (e.g. after being throttled) so that we
+        don't immediately burst again
+        """
+        with self.lock:
+            self.tokens = 0
+            self.last_refill = time.monotonic()
+
+    def release(self, throttled):
+        """
+        Adjust the rate based on the result of a request
+        """
+        with self.lock:
+            # Bank the tokens earned at the old rate before changing it
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if throttled:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= int(self.rate):
+                    self.rate = min(self.max_rate, self.rate + REQUESTS_PER_SECOND_INCREASE)
+                    self.successes = 0
+
+class AimdController:
+    """
+    Limits the number of requests in flight at once. The limit grows by one
+    after each full window of successful requests (additive increase) and is
+    halved whenever we get throttled (multiplicative decrease).
+    """
+    def __init__(self, initial, maximum):
+        self.limit = initial
+        self.maximum = maximum
+        self.in_flight = 0
+        self.successes = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait for a free request slot and take it
+        """
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled):
+        """
+        Give back a request slot and adjust the limit based on the result
+        """
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= int(self.limit):
+                    self.limit = min(self.maximum, self.limit + 1)
+                    self.successes = 0
+            self.cond.notify_all()
+
+    def cancel(self):
+        """
+        Give back a request slot that was never used, without adjusting the
+        limit
+        """
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+class RateLimiter:
+    """
+    Rate control shared by every request to Spotify: a token bucket caps the
+    request rate, an AIMD controller caps concurrency (both adapt when we get
+    throttled), and a 429 response pauses all callers for as long as its
+    Retry-After header asks.
+    """
+    def __init__(self, rate=DEFAULT_REQUESTS_PER_SECOND, burst=DEFAULT_BURST,
+                 concurrency=DEFAULT_CONCURRENCY, max_concurrency=MAX_CONCURRENCY,
+                 max_rate=MAX_REQUESTS_PER_SECOND):
+        self.bucket = TokenBucket(rate, burst, max_rate=max_rate)
+        self.aimd = AimdController(concurrency, max_concurrency)
+        self.resume_time = 0.0
+        self.throttle_count = 0
+        self.completed = collections.deque()
+        self.lock = threading.Lock()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) once the budget allows it, retrying if Spotify
+        responds with HTTP 429
+        """
+        retries = 0
+        while True:
+            self._wait_for_resume()
+            self.aimd.acquire()
+            throttled = False
+            sent = False
+            try:
+                self.bucket.acquire()
+                # Another request may have been throttled while this one waited
+                # for its slot or token, so check again before sending it
+                if self._paused():
+                    continue
+                sent = True
+                return func(*args, **kwargs)
+            except Exception as err:
+                # spotipy raises SpotifyException, which is checked by its status
+                # so that spotipy doesn't need to be imported here
+                if getattr(err, "http_status", None) != 429 or retries >= MAX_THROTTLE_RETRIES:
+                    raise
+                throttled = True
+                retries += 1
+                self._throttle(err.headers.get("Retry-After"), retries)
+            finally:
+                if not sent:
+                    self.aimd.cancel()
+                else:
+                    self.aimd.release(throttled)
+                    self.bucket.release(throttled)
+                    if not throttled:
+                        self._record_completion()
+
+    def throughput(self):
+        """
+        Get the number of requests per second completed over the last
+        THROUGHPUT_WINDOW seconds
+        """
+        with self.lock:
+            self._expire_completions(time.monotonic())
+            return len(self.completed) / THROUGHPUT_WINDOW
+
+    def _paused(self):
+        """
+        Check if we are backing off after a 429
+        """
+        with self.lock:
+            return self.resume_time > time.monotonic()
+
+    def _wait_for_resume(self):
+        """
+        Block while we are backing off after a 429
+        """
+        while True:
+            with self.lock:
+                wait = self.resume_time - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _throttle(self, retry_after, attempt):
+        """
+        Pause all callers after a 429. If the server didn't say how long to wait,
+        back off exponentially.
+        """
+        try:
+            wait = float(retry_after)
+        except (TypeError, ValueError):
+            wait = DEFAULT_RETRY_AFTER * 2 ** (attempt - 1)
+        with self.lock:
+            self.throttle_count += 1
+            self.resume_time = max(self.resume_time, time.monotonic() + wait)
+        self.bucket.drain()
+
+    def _record_completion(self):
+        """
+        Save the time a request completed for throughput measurement
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.completed.append(now)
+            self._expire_completions(now)
+
+    def _expire_completions(self, now):
+        while self.completed and self.completed[0] < now - THROUGHPUT_WINDOW:
+            self.completed.popleft()
+
 class Spotify:
     """
     Represents a single connection to a Spotify account
     """
-    def __init__(self):
+    def __init__(self, rate_limiter=None, artist_cache=None, auth_cache_path=None):
         """
-        Default constructor
+        Default constructor. Pass in a RateLimiter to share one request budget
+        between several connections, and an ArtistCache to share artist data
+        (related artists and discographies) between them.
+
+        auth_cache_path is where the account's login token is saved (by default,
+        .cache in the current directory), so each account needs its own.
         """
-        self.sp = None
+        self._sp = None
+        self.connect_lock = threading.Lock()
+        if rate_limiter is None:
+            rate_limiter = RateLimiter()
+        self.rate_limiter = rate_limiter
+        self.artist_cache = artist_cache
+        self.auth_cache_path = auth_cache_path
+        self.stats = api_stats.ApiStats()
 
-    def connect(self):
+    @property
+    def sp(self):
         """
-        Create connection to account. This must be called before any other
-        functions.
+        The spotipy client for this account. The connection is made the first
+        time it is needed (only once, even if several threads need it at once).
         """
-        self.sp = spotipy.Spotify(auth_manager=SpotifyOAuth(scope=SPOTIFY_SCOPE))
+        if self._sp is None:
+            with self.connect_lock:
+                if self._sp is None:
+                    self.connect()
+        return self._sp
+
+    @sp.setter
+    def sp(self, client):
+        self._sp = client
+
+    def connect(self, auth_manager=None, api_prefix=None):
+        """
+        Create connection to account. This is done automatically the first time
+        Spotify is used. It doesn't log in: spotipy only asks the user to log in
+        on the first request, so call login() to do that up front.
+
+        auth_manager and api_prefix can be overridden to point at a different
+        server (e.g. a local fake one for testing).
+        """
+        # spotipy is slow to import, so only import it once we need to connect
+        from . import spotify_client
+        if auth_manager is None:
+            auth_manager = spotify_client.create_auth_manager(SPOTIFY_SCOPE, self.auth_cache_path)
+        self._sp = spotify_client.RateLimitedClient(self.rate_limiter, self.stats, auth_manager=auth_manager)
+        if api_prefix:
+            self._sp.prefix = api_prefix
+
+    def login(self):
+        """
+        Make sure the user is logged in, asking them to log in now (by pasting
+        a URL into the console) if there's no saved login token. Otherwise
+        spotipy only asks during the first request. Raises RuntimeError if the
+        login fails.
+        """
+        try:
+            self.sp.auth_manager.get_access_token(as_dict=False)
+        except Exception as err:
+            raise RuntimeError("Could not log in to Spotify: {}".format(err))
+
+    def throughput(self):
+        """
+        Get the current number of requests per second being made to Spotify
+        """
+        return self.rate_limiter.throughput()
+
+    def request_count(self):
+        """
+        Get the number of requests made to Spotify so far. Clients that never
+        touch the network (like the bench's synthetic and replay clients) keep
+        their own count, since their requests don't reach the API stats.
+        """
+        count = getattr(self._sp, "request_count", None)
+        if isinstance(count, int):
+            return count
+        return self.stats.total_calls()
+
+    def record_cache_hit(self, endpoint):
+        """
+        Record in the API stats that a request was avoided by using cached data
+        """
+        self.stats.record_cache_hit(endpoint)
 
     def playlist_exists(self, name):
         """
@@ -45,13 +403,40 @@ class Spotify:
         print("TODO: create_playlist()")
         return uri
 
-    def load_playlist(self, playlist_name):
+    def find_playlists(self, patterns):
         """
-        Find a playlist with the specified name and load a list of songs from it
+        Find all of the user's playlists whose names match any of a list of
+        patterns, which can contain shell-style wildcards (e.g. "Rotation *").
+        This takes a single sweep through the user's playlists.
+
+        Returns a dictionary of <name : uri> pairs, in the order the playlists
+        appear in the user's library
+        """
+        matches = dict()
+        # If there are no wildcards, we can stop as soon as everything is found
+        exact = not any(is_pattern(p) for p in patterns)
+        playlists = self.sp.current_user_playlists(limit=50)
+        while playlists:
+            for playlist in playlists['items']:
+                name = playlist['name']
+                if not name in matches and any(name == p or fnmatch.fnmatchcase(name, p) for p in patterns):
+                    matches[name] = playlist['uri']
+            if playlists["next"] and not (exact and len(matches) == len(set(patterns))):
+                playlists = self.sp.next(playlists)
+            else:
+                playlists = None
+        return matches
+
+    def load_playlist(self, playlist_name, uri=None):
+        """
+        Find a playlist with the specified name and load a list of songs from it.
+        If its uri is already known (e.g. from find_playlists()), pass it in to
+        skip the search.
         """
 
         # Search for a playlist with the specified name
-        uri = self._lookup_playlist(playlist_name)
+        if uri is None:
+            uri = self._lookup_playlist(playlist_name)
         if not uri:
             raise RuntimeError(
                 "No playlist with name {} found in user library".format(playlist_name))
@@ -77,20 +462,31 @@ class Spotify:
             self.sp.playlist_add_items(uri, song_uris[start_idx:end_idx])
             start_idx = end_idx
 
-    def load_library(self, songs, show_progress):
+    def load_library(self, songs, show_progress, new_songs=None, offset=0, on_page=None):
         """
         Given a list of songs that have already been loaded, read this user's
         saved song list and return a list of any new songs that aren't already
         in that list. If show_progress=True, it will print dots to the console to
         show that it is running (useful for long runs)
+
+        To resume an interrupted load, pass in the new_songs found so far and the
+        offset of the next page that has not been fetched. If on_page is given,
+        it is called as on_page(new_songs, offset) after each page is processed,
+        where offset is the next unfetched offset.
         """
-        new_songs = []
-        results = self.sp.current_user_saved_tracks()
+        if new_songs is None:
+            new_songs = []
+        if not isinstance(songs, song_table.SongTable):
+            songs = song_table.SongTable(songs)
+        # When resuming, songs liked since the interruption shift the offsets, so
+        # a few songs may be seen twice
+        new_uris = set(s["uri"] for s in new_songs)
+        results = self.sp.current_user_saved_tracks(limit=LIBRARY_PAGE_SIZE, offset=offset)
         total = results["total"]
-        progress = 0
+        progress = offset
         done = False
         if show_progress:
-            log.show_progress(0, total)
+            log.show_progress(min(progress, total), total)
 
         while results:
             for i, item in enumerate(results["items"]):
@@ -119,68 +515,176 @@ class Spotify:
                     "duration": duration,
                     "explicit": explicit
                 }
-                if self._uri_in_song_list(songs, uri):
+                if songs.contains_uri(uri):
                     # Assumption: Songs are always in order by date added.
                     # If we get to one that's already in the song list, all of the
                     # rest of the list will also be in the songlist
                     done = True
                     break
-                else:
+                elif not uri in new_uris:
                     # If this song is not in the list, add it now
                     new_songs.append(song)
+                    new_uris.add(uri)
             progress += len(results["items"])
+            if on_page and not done:
+                on_page(new_songs, progress)
             if results["next"] and not done:
                 results = self.sp.next(results)
             else:
                 results = None
             if show_progress:
-                log.show_progress(progress, total)
+                log.show_progress(min(progress, total), total)
+
+        # Stopping early at a known song means the library is fully loaded
+        if show_progress and progress < total:
+            log.show_progress(total, total)
 
         return new_songs
 
+    def reconcile_library(self, songs):
+        """
+        Given the full list of songs loaded so far (including any new songs from
+        load_library()), find the ones that are no longer in this user's saved
+        song list and return them.
+
+        load_library() only looks for songs added since the last run, so songs
+        that were un-liked are never noticed. Rather than reading the whole
+        library again, this compares the saved song count with the number of
+        cached songs, then bisects the library with single-song requests to
+        find the regions where cached songs have gone missing. Only those
+        regions are read in full, so a few removals cost O(log n) requests.
+        """
+        # The saved song list is ordered by date added, newest first
+        if not isinstance(songs, song_table.SongTable):
+            songs = song_table.SongTable(songs)
+        expected = songs.sorted_by("added_at", reverse=True)
+        index = {song["uri"]: i for i, song in enumerate(expected)}
+
+        total = self._saved_track_uri(0, with_total=True)[1]
+        missing = len(expected) - total
+        if missing == 0:
+            return []
+        if missing < 0:
+            log.warning("Found {} more saved songs than expected. Delete the library cache "
+                        "to load the whole library again.".format(-missing))
+            return []
+
+        # shift(offset) is how many cached songs are missing before the saved
+        # song at that offset. It is 0 before the first song and `missing`
+        # after the last one, and it only changes where songs were removed.
+        removed = []
+        def search(lo, shift_lo, hi, shift_hi):
+            if shift_lo == shift_hi:
+                return
+            if hi - lo - 1 <= RECONCILE_PAGE_SIZE:
+                removed.extend(self._find_removed_songs(expected, lo, shift_lo, hi, shift_hi))
+                return
+            mid = (lo + hi) // 2
+            uri = self._saved_track_uri(mid)
+            if not uri in index:
+                # Not a song we know about, so the order can't be trusted here
+                removed.extend(self._find_removed_songs(expected, lo, shift_lo, hi, shift_hi))
+                return
+            shift_mid = index[uri] - mid
+            search(lo, shift_lo, mid, shift_mid)
+            search(mid, shift_mid, hi, shift_hi)
+        search(-1, 0, total, missing)
+        return removed
+
     def get_related_artists(self, artist_id):
         """
         Get a list of related artists for an artist based on its ID
         """
+        if self.artist_cache:
+            cached = self.artist_cache.get_related_artists(artist_id)
+            if cached is not None:
+                self.record_cache_hit("artist_related_artists")
+                return cached
+
         result = self.sp.artist_related_artists(artist_id)
         artist_ids = []
         artist_names = []
         for artist in result["artists"]:
             artist_ids.append(artist["id"])
             artist_names.append(artist["name"])
+
+        if self.artist_cache:
+            self.artist_cache.set_related_artists(artist_id, artist_ids, artist_names)
         return artist_ids, artist_names
 
-    def get_new_albums(self, artist_id, min_time, singles):
+    def get_new_releases(self, artist_id, min_time):
         """
-        Get a list of all albums that an artist has released since a specific date.
+        Get lists of all albums and all singles (or eps) that an artist has
+        released since a specific date. Albums include releases the artist
+        appears on.
 
-        If singles=True, return singles & eps. If singles=False, return full albums.
+        Every group is requested at once and split up by each release's
+        album_group, so most artists take a single request.
         """
+        if self.artist_cache:
+            cached = self.artist_cache.get_discography(artist_id, min_time)
+            if cached is not None:
+                self.record_cache_hit("artist_albums")
+                return cached
+
+        found = self._get_new_releases_by_group(artist_id, min_time, RELEASE_GROUPS)
         albums = []
-        done = False
-        if singles:
-            atype = "single"
-        else:
-            atype = "album,appears_on"
-        results = self.sp.artist_albums(artist_id, album_type=atype, limit=50)
+        singles = []
+        for group in RELEASE_GROUPS:
+            if group == "single":
+                singles.extend(found[group])
+            else:
+                albums.extend(found[group])
+
+        if self.artist_cache:
+            self.artist_cache.set_discography(artist_id, min_time, albums, singles)
+        return albums, singles
+
+    def get_release_feed(self, min_time):
+        """
+        Get every release since a specific date that is in Spotify's new
+        release listings or in an album search for new releases. Each release
+        also has the ids of all of its artists (artist_ids), and whether it is
+        a single or ep (single).
+
+        The feed doesn't list every new release (the search only covers the
+        last two weeks), but reading it takes a couple dozen requests no matter
+        how many artists are in the taste profile.
+        """
+        releases = []
+        seen = set()
+        def add_page(results):
+            for item in results["albums"]["items"]:
+                if item is None or item["id"] in seen:
+                    continue
+                seen.add(item["id"])
+                release_date = self._get_release_date(item)
+                if release_date >= min_time:
+                    releases.append({
+                        "name": item["name"],
+                        "artist": item["artists"][0]["name"],
+                        "id": item["id"],
+                        "release_date": release_date,
+                        "artist_ids": [artist["id"] for artist in item["artists"]],
+                        "single": item["album_type"] == "single"
+                    })
+
+        results = self.sp.new_releases(limit=50)
         while results:
-            for i, item in enumerate(results["items"]):
-                album = {
-                    "name": item["name"],
-                    "artist": item["artists"][0]["name"],
-                    "id": item["id"],
-                    "release_date": self._get_release_date(item)
-                }
-                if album["release_date"] < min_time:
-                    done = True
-                    break 
-                else:
-                    albums.append(album)
-            if results["next"] and not done:
-                results = self.sp.next(results)
+            add_page(results)
+            if results["albums"]["next"]:
+                results = self.sp.next(results["albums"])
             else:
                 results = None
-        return albums
+
+        offset = 0
+        while offset < MAX_SEARCH_RESULTS:
+            results = self.sp.search(NEW_RELEASE_QUERY, limit=50, offset=offset, type="album")
+            add_page(results)
+            if not results["albums"]["next"]:
+                break
+            offset += 50
+        return releases
 
     def get_artists_singles(self, artist_id):
         """
@@ -225,6 +729,81 @@ class Spotify:
 
         return uri
 
+    def _saved_track_uri(self, offset, with_total=False):
+        """
+        Get the uri of the saved song at an offset in this user's saved song
+        list (and, if with_total=True, the number of saved songs)
+        """
+        results = self.sp.current_user_saved_tracks(limit=1, offset=offset)
+        uri = results["items"][0]["track"]["uri"] if results["items"] else None
+        if with_total:
+            return uri, results["total"]
+        return uri
+
+    def _find_removed_songs(self, expected, lo, shift_lo, hi, shift_hi):
+        """
+        Read the saved songs strictly between offsets lo and hi, and return the
+        songs from the matching region of the expected (cached) list that
+        aren't among them
+        """
+        saved = set()
+        offset = lo + 1
+        while offset < hi:
+            limit = min(RECONCILE_PAGE_SIZE, hi - offset)
+            results = self.sp.current_user_saved_tracks(limit=limit, offset=offset)
+            if not results["items"]:
+                break
+            for item in results["items"]:
+                saved.add(item["track"]["uri"])
+            offset += len(results["items"])
+        return [song for song in expected[lo + shift_lo + 1:hi + shift_hi]
+                if not song["uri"] in saved]
+
+    def _get_new_releases_by_group(self, artist_id, min_time, groups):
+        """
+        Get the releases of each album group (from RELEASE_GROUPS) that came
+        out since a specific date, as a dictionary of <group : [releases]>.
+
+        Spotify lists releases group by group, newest first within each group,
+        so a group is done as soon as one of its releases is too old or a later
+        group starts. If a page ends while still skipping old releases, the
+        groups that haven't started yet are requested on their own instead of
+        paging through the rest of the old ones.
+        """
+        found = {group: [] for group in groups}
+        done = set()
+        results = self.sp.artist_albums(artist_id, include_groups=",".join(groups), limit=50)
+        while results:
+            group = None
+            for item in results["items"]:
+                # Older responses only have album_type, which can't tell
+                # appears_on releases from albums
+                group = item.get("album_group", item["album_type"])
+                if not group in found:
+                    continue
+                # Groups come in order, so any before this one are finished
+                done.update(groups[:groups.index(group)])
+                if group in done:
+                    continue
+                release_date = self._get_release_date(item)
+                if release_date < min_time:
+                    done.add(group)
+                else:
+                    found[group].append({
+                        "name": item["name"],
+                        "artist": item["artists"][0]["name"],
+                        "id": item["id"],
+                        "release_date": release_date
+                    })
+            if len(done) == len(groups) or not results["next"]:
+                break
+            if group in done and len(groups) > 1:
+                for remaining in [g for g in groups if not g in done]:
+                    found.update(self._get_new_releases_by_group(artist_id, min_time, [remaining]))
+                break
+            results = self.sp.next(results)
+        return found
+
     def _load_playlist(self, uri):
         """
         Load all songs from a playlist to a list of dictionaries
@@ -265,12 +844,6 @@ class Spotify:
                 results = None
         return songs
 
-    def _uri_in_song_list(self, songs, uri):
-        """
-        Check if a song is already in a songlist, based solely on URI.
-        """
-        return any(s["uri"] == uri for s in songs)
-
     def _get_release_date(self, item):
         """
         Extract release date as a datetime object
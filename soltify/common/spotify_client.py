@@ -0,0 +1,81 @@
+"""
+Soltify/Common/Spotify Client
+
+spotipy client used by the Spotify class. This is kept separate so that spotipy
+(and requests under it) is only imported once we actually connect.
+"""
+import threading
+import time
+
+import requests
+import spotipy
+from spotipy.oauth2 import SpotifyOAuth
+from urllib3.util.retry import Retry
+
+# HTTP errors that spotipy retries on its own. 429 is left out so that the
+# rate limiter sees it and can honor Retry-After for every caller at once.
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+def create_auth_manager(scope, cache_path=None):
+    """
+    Create the default OAuth manager, which reads its settings from the
+    SPOTIPY_* environment variables and saves the login token to cache_path
+    """
+    return SpotifyOAuth(scope=scope, cache_path=cache_path)
+
+class RateLimitedClient(spotipy.Spotify):
+    """
+    spotipy client that sends every request through a RateLimiter and records
+    telemetry for it in an ApiStats
+    """
+    def __init__(self, rate_limiter, stats, **kwargs):
+        self.rate_limiter = rate_limiter
+        self.stats = stats
+        self.response_bytes = threading.local()
+        super().__init__(status_forcelist=RETRY_STATUS_CODES, **kwargs)
+
+    def _build_session(self):
+        # Replace spotipy's retry policy with one that never retries a 429 on
+        # its own, so the response (and its Retry-After) reaches the rate limiter
+        self._session = requests.Session()
+        retry = Retry(
+            total=self.retries,
+            connect=None,
+            read=False,
+            allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+            status=self.status_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.status_forcelist,
+            respect_retry_after_header=False)
+        adapter = requests.adapters.HTTPAdapter(max_retries=retry)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.hooks["response"].append(self._on_response)
+
+    def _on_response(self, response, *args, **kwargs):
+        # Requests are made on the calling thread, so this tells _timed_call
+        # how big its response was
+        self.response_bytes.value = len(response.content)
+
+    def _internal_call(self, method, url, payload, params):
+        endpoint = self.stats.endpoint_name(method, url)
+        return self.rate_limiter.call(self._timed_call, endpoint, method, url, payload, params)
+
+    def _timed_call(self, endpoint, method, url, payload, params):
+        """
+        Make a single request and record its telemetry
+        """
+        self.response_bytes.value = 0
+        start = time.perf_counter()
+        error = False
+        try:
+            return super()._internal_call(method, url, payload, params)
+        except spotipy.SpotifyException as err:
+            if err.http_status == 429:
+                self.stats.record_retry(endpoint)
+            else:
+                error = True
+            raise
+        finally:
+            self.stats.record_call(endpoint, time.perf_counter() - start,
+                                   self.response_bytes.value, error)
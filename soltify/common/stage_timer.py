@@ -0,0 +1,102 @@
+"""
+Soltify/Common/Stage Timer
+
+Helper class, StageTimer, that measures how long each stage of a tool takes
+and can profile where the CPU time in each stage goes
+"""
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+# Subdirectory of the cache directory that profiles are saved to
+PROFILE_DIRNAME = "profile"
+
+class StageTimer:
+    """
+    Measures the wall clock and CPU time of each stage of a run. Each call to
+    start() ends the previous stage; stop() ends the last one.
+
+    If profile_dir is given, each stage is also profiled with cProfile and its
+    stats are saved to <profile_dir>/<NN>-<stage>.prof (readable with pstats or
+    tools like snakeviz), along with the timings in timings.json. Only the
+    thread that calls start() is profiled, not worker threads or processes.
+    """
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.stages = dict()
+        self.current = None
+        self.profiler = None
+        self.num_profiles = 0
+        if profile_dir and not os.path.exists(profile_dir):
+            os.makedirs(profile_dir)
+
+    def start(self, name):
+        """
+        End the current stage (if any) and start timing a new one
+        """
+        self.stop()
+        self.current = {"name": name, "wall": time.perf_counter(), "cpu": time.process_time()}
+        if self.profile_dir:
+            # cProfile is only imported when profiling, since it's rarely needed
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self):
+        """
+        End the current stage
+        """
+        if self.current is None:
+            return
+        if self.profiler:
+            self.profiler.disable()
+            filename = "{:02d}-{}.prof".format(self.num_profiles, _stage_filename(self.current["name"]))
+            self.profiler.dump_stats(os.path.join(self.profile_dir, filename))
+            self.profiler = None
+            self.num_profiles += 1
+        name = self.current["name"]
+        entry = self.stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0})
+        entry["wall_s"] += time.perf_counter() - self.current["wall"]
+        entry["cpu_s"] += time.process_time() - self.current["cpu"]
+        self.current = None
+
+    def print_summary(self):
+        """
+        Print a table of the time spent in each stage
+        """
+        print("Stage timings:")
+        print("  {:<28} {:>9} {:>9}".format("Stage", "Wall s", "CPU s"))
+        for name, entry in self.stages.items():
+            print("  {:<28} {:>9.3f} {:>9.3f}".format(name, entry["wall_s"], entry["cpu_s"]))
+        print("  {:<28} {:>9.3f} {:>9.3f}".format("total", sum(e["wall_s"] for e in self.stages.values()),
+                                                   sum(e["cpu_s"] for e in self.stages.values())))
+
+    def save(self):
+        """
+        Save the timings of each stage to timings.json in the profile
+        directory (if profiling)
+        """
+        if not self.profile_dir:
+            return
+        with open(os.path.join(self.profile_dir, "timings.json"), "w", encoding="utf-8") as file:
+            json.dump(self.stages, file, indent=2)
+
+def profile_dir(cache_dir, tool):
+    """
+    Get a new directory under a cache directory to save the profile of one run
+    of a tool to. Each run gets its own directory, named by tool and start
+    time, so runs (e.g. before and after a change) can be compared.
+    """
+    name = "{}-{}".format(tool, datetime.now().strftime("%Y%m%d-%H%M%S"))
+    return os.path.join(cache_dir, PROFILE_DIRNAME, name)
+
+################################################################################
+# Private Functions
+################################################################################
+def _stage_filename(name):
+    """
+    Convert a stage name to something that can be used in a filename
+    """
+    return re.sub(r'[^a-z0-9]+', "_", name.lower()).strip("_")
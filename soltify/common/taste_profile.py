@@ -4,34 +4,92 @@ Soltify/Common/Taste Profile
 Helper functions related to creating a taste profile for you based on your liked
 songs and scoring artists against that profile
 """
+import concurrent.futures
 import copy
 from datetime import datetime, timedelta
 
 from . import log
 
-def update_taste_profile(songs, taste, taste_years, sp, show_progress):
+# Number of related artist lookups made at the same time
+RELATED_ARTIST_WORKERS = 8
+
+# Lookups queued per worker at a time. Only a few are queued ahead, so an error
+# or Ctrl-C doesn't have to wait for every remaining lookup to finish.
+RELATED_ARTIST_QUEUE_PER_WORKER = 2
+
+def update_taste_profile(songs, taste, taste_years, sp, show_progress, done=None, on_artist=None,
+                         workers=RELATED_ARTIST_WORKERS, on_update=None, budget=None):
     """
     From a list of liked songs, generate or update a taste profile.
 
     A taste profile is data on the number of liked songs by artists or related
     artists
 
-    When necessary, connect to spotify to get related artist information
+    When necessary, connect to spotify to get related artist information. All
+    of the related artists that are missing are fetched several at a time
+    (workers), and each artist is added as soon as its related artists are
+    known. Artists whose related artists are already in the profile are added
+    first, without waiting on any requests.
+
+    To resume an interrupted update, pass in the set of artist ids that were
+    already added (done). If on_artist is given, it is called as
+    on_artist(taste, done) after each artist is added. If on_update is given,
+    it is called as on_update(taste, artist_ids) with the ids whose liked counts
+    just changed (e.g. to act on scores before the whole update finishes).
+
+    If a Budget is given, lookups stop once it can't afford another request.
+    Returns the ids of the artists that weren't added because of that.
     """
+    if done is None:
+        done = set()
 
     # For the list of songs, get a count of how many songs there are by each
     # artist
     min_release_date = datetime.now() - timedelta(days=365.25*taste_years)
     artist_counts, artist_names = _get_artist_counts(songs, min_release_date)
-    if show_progress:
-        total = len(artist_counts)
-        i = 0
-        log.show_progress(0, total)
+
+    # Split the artists into ones whose related artists are already known and
+    # ones that need to be fetched
+    known = []
+    missing = []
+    for artist_id in artist_counts:
+        if artist_id in done:
+            continue
+        if artist_id in taste and taste[artist_id]["related_artists"]:
+            sp.record_cache_hit("artist_related_artists")
+            known.append(artist_id)
+        else:
+            missing.append(artist_id)
+
+    def add(artist_id):
+        _add_to_taste_profile(taste, artist_names, artist_id, artist_counts[artist_id])
+        done.add(artist_id)
+        if on_artist:
+            on_artist(taste, done)
+        if on_update:
+            on_update(taste, [artist_id] + taste[artist_id]["related_artists"])
+
+    for artist_id in known:
+        add(artist_id)
+    return _prefetch_related_artists(taste, artist_names, missing, sp, workers, show_progress, add, budget)
+
+def remove_from_taste_profile(songs, taste, taste_years):
+    """
+    Take songs that are no longer liked back out of a taste profile, undoing
+    what update_taste_profile() added for them
+    """
+    min_release_date = datetime.now() - timedelta(days=365.25*taste_years)
+    artist_counts, artist_names = _get_artist_counts(songs, min_release_date)
     for artist_id, count in artist_counts.items():
-        _add_to_taste_profile(taste, artist_names, artist_id, count, sp)
-        if show_progress:
-            i += 1
-            log.show_progress(i, total)
+        if not artist_id in taste:
+            continue
+        # Songs that were released outside the window when they were added
+        # were never counted, so don't let counts go below zero
+        count = min(count, taste[artist_id]["liked_songs"])
+        taste[artist_id]["liked_songs"] -= count
+        for related in taste[artist_id]["related_artists"]:
+            if related in taste:
+                taste[related]["liked_related"] = max(taste[related]["liked_related"] - count, 0)
 
 def assign_scores(taste, taste_pts0, taste_pts1):
     """
@@ -73,9 +131,10 @@ def _get_artist_counts(songs, min_release_date):
                 names[artist_id] = song["artist"]
     return counts, names
 
-def _add_to_taste_profile(taste, artist_names, artist_id, liked_songs, sp):
+def _add_to_taste_profile(taste, artist_names, artist_id, liked_songs):
     """
-    Add a new artist to the taste profile with a specific number of liked songs
+    Add a new artist to the taste profile with a specific number of liked songs.
+    Its related artists must already have been fetched.
     """
 
     # If this is the first time we've encountered this artist, add a blank entry
@@ -83,9 +142,6 @@ def _add_to_taste_profile(taste, artist_names, artist_id, liked_songs, sp):
     if not artist_id in taste:
         _create_taste_profile_entry(taste, artist_names[artist_id], artist_id)
 
-    # Populate related artist list for this artist and all of its related artists
-    _populate_related_artists(taste, artist_names, artist_id, sp)
-
     # Make sure all related artists have entries in the taste profile
     for related in taste[artist_id]["related_artists"]:
         if not related in taste:
@@ -106,15 +162,61 @@ def _create_taste_profile_entry(taste, artist_name, artist_id):
         entry["related_artists"] = []
         taste[artist_id] = copy.deepcopy(entry)
 
-def _populate_related_artists(taste, artist_names, artist_id, sp):
+def _prefetch_related_artists(taste, artist_names, artist_ids, sp, workers, show_progress, on_fetch,
+                              budget=None):
     """
-    Populate the "related_artists" field in taste profile for a given artist_id.
+    Fetch related artists from spotify for a list of artist ids, several at a
+    time, and save them in the taste profile.
+
+    Each result is saved as soon as it arrives (along with entries for the
+    related artists, so their names are kept too) and on_fetch(artist_id) is
+    called, so the artist can be used right away and an interrupted run doesn't
+    have to fetch it again.
 
-    If it doesn't already exist, we go out to spotify for this.
+    Once the budget (if given) can't afford another lookup, no more are started.
+    Returns the ids that weren't fetched because of that.
     """
-    related_artists = taste[artist_id]["related_artists"]
-    if not related_artists:
-        related_artist_ids, related_artist_names = sp.get_related_artists(artist_id)
-        taste[artist_id]["related_artists"] = copy.deepcopy(related_artist_ids)
-        for i, artist_id in enumerate(related_artist_ids):
-            artist_names[artist_id] = related_artist_names[i]
+    if not artist_ids:
+        return []
+    total = len(artist_ids)
+    if show_progress:
+        log.show_progress(0, total, "Related artists")
+    queue_size = workers * RELATED_ARTIST_QUEUE_PER_WORKER
+    remaining = iter(artist_ids)
+    futures = dict()
+    fetched = 0
+    out_of_budget = False
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        try:
+            while True:
+                while len(futures) < queue_size and not out_of_budget:
+                    # Lookups that are already running will make requests too
+                    if budget and not budget.can_afford(len(futures) + 1):
+                        out_of_budget = True
+                        break
+                    artist_id = next(remaining, None)
+                    if artist_id is None:
+                        break
+                    futures[executor.submit(sp.get_related_artists, artist_id)] = artist_id
+                if not futures:
+                    break
+                finished, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    artist_id = futures.pop(future)
+                    related_artist_ids, related_artist_names = future.result()
+                    if not artist_id in taste:
+                        _create_taste_profile_entry(taste, artist_names[artist_id], artist_id)
+                    taste[artist_id]["related_artists"] = copy.deepcopy(related_artist_ids)
+                    for related, name in zip(related_artist_ids, related_artist_names):
+                        artist_names[related] = name
+                        if not related in taste:
+                            _create_taste_profile_entry(taste, name, related)
+                    on_fetch(artist_id)
+                    fetched += 1
+                    if show_progress:
+                        log.show_progress(fetched, total, "Related artists")
+        except BaseException:
+            # Don't wait on lookups that haven't started
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    return list(remaining)
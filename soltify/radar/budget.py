@@ -0,0 +1,147 @@
+"""
+Soltify/Radar/Budget
+
+Helpers that estimate how many requests to Spotify each stage of a run will
+make, and limit a run to a number of requests or an amount of time
+"""
+import time
+from datetime import datetime, timedelta
+
+from ..common import spotify
+
+# Requests assumed for an artist's release search if it has never been
+# searched before (one page with every album group)
+DEFAULT_RELEASE_REQUESTS = 1
+
+# Requests assumed for reading the new release feed (up to 100 new releases
+# and 1000 search results, 50 per page)
+FEED_REQUESTS = 22
+
+# Days of the cached library (before the last run) whose liked songs are
+# counted to estimate how many songs were liked since
+LIBRARY_RATE_DAYS = 90
+
+class Budget:
+    """
+    A limit on the number of requests to Spotify (max_requests) and/or the
+    number of seconds (deadline) a run can take, counted from when the Budget
+    is created. Either can be None for no limit.
+    """
+    def __init__(self, sp, max_requests=None, deadline=None):
+        self.sp = sp
+        self.max_requests = max_requests
+        self.start_time = time.time()
+        self.end_time = None if deadline is None else self.start_time + deadline
+        self.start_count = sp.request_count()
+
+    def used(self):
+        """
+        Get the number of requests made since the budget started
+        """
+        return self.sp.request_count() - self.start_count
+
+    def remaining(self):
+        """
+        Get the number of requests left, or None if there is no request limit
+        """
+        if self.max_requests is None:
+            return None
+        return max(self.max_requests - self.used(), 0)
+
+    def can_afford(self, requests, seconds=0.0):
+        """
+        Check if there is enough of the budget left for a task estimated to
+        make this many requests and take this many seconds
+        """
+        remaining = self.remaining()
+        if remaining is not None and requests > remaining:
+            return False
+        if self.end_time is not None and time.time() + seconds > self.end_time:
+            return False
+        return True
+
+def release_requests(entry):
+    """
+    Get the estimated number of requests to search for an artist's releases,
+    from the number the last search of that artist took
+    """
+    return entry.get("release_requests", DEFAULT_RELEASE_REQUESTS)
+
+def plan_library_requests(songs, last_run_time, current_time, reconcile):
+    """
+    Estimate the number of requests to load the songs liked since the last run,
+    from how many songs per day were liked in the cached library before it and
+    the page size. If reconcile=True, checking for removed songs is counted
+    too (one request, unless some were removed).
+
+    Returns None if there is no cached library, since then the size of the
+    library isn't known until it's read
+    """
+    if not songs:
+        return None
+    since = (last_run_time - timedelta(days=LIBRARY_RATE_DAYS)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    recent = sum(1 for song in songs if song["added_at"] and song["added_at"] >= since)
+    days = max((current_time - last_run_time).total_seconds() / (24 * 60 * 60), 0.0)
+    new_songs = recent / LIBRARY_RATE_DAYS * days
+    # The last page is the one that reaches the first cached song
+    requests = int(new_songs // spotify.LIBRARY_PAGE_SIZE) + 1
+    if reconcile:
+        requests += 1
+    return requests
+
+def plan_requests(new_songs, taste, taste_years, taste_pts0, taste_pts1, taste_thresh, max_artists=None,
+                  pending=None):
+    """
+    Estimate the number of requests the taste and release stages of a run will
+    make for a list of new songs, without making any requests. Each
+    artist's release search is estimated from the number of pages it took
+    last time. If max_artists is given, only the pending artists and the
+    max_artists highest scoring artists are scanned (as with the feed scan
+    strategy).
+
+    Returns a dictionary of <stage : requests>
+    """
+    # Every new artist without related artists needs one lookup
+    min_release_date = datetime.now() - timedelta(days=365.25*taste_years)
+    new_counts = dict()
+    for song in new_songs:
+        if song["release_date"] >= min_release_date:
+            new_counts[song["artist_id"]] = new_counts.get(song["artist_id"], 0) + 1
+    related_lookups = sum(1 for artist_id in new_counts
+                          if not (artist_id in taste and taste[artist_id]["related_artists"]))
+
+    # Every artist that already passes the threshold, or passes it with its
+    # new liked songs alone, gets its releases searched. Scores from new
+    # related artists aren't known yet, so this is a lower bound.
+    # <artist_id : (score, requests)>
+    releases = dict()
+    for artist_id, entry in taste.items():
+        score = (entry["liked_songs"] + new_counts.get(artist_id, 0)) * taste_pts0 + \
+                entry["liked_related"] * taste_pts1
+        if score > taste_thresh:
+            releases[artist_id] = (score, release_requests(entry))
+    for artist_id, count in new_counts.items():
+        if not artist_id in taste and count * taste_pts0 > taste_thresh:
+            releases[artist_id] = (count * taste_pts0, DEFAULT_RELEASE_REQUESTS)
+    if max_artists is not None:
+        scanned = sorted(releases, key=lambda artist_id: releases[artist_id][0], reverse=True)[:max_artists]
+        scanned = set(scanned) | set(artist_id for artist_id in (pending or []) if artist_id in releases)
+        releases = {artist_id: releases[artist_id] for artist_id in scanned}
+
+    return {"taste": related_lookups, "releases": sum(requests for score, requests in releases.values())}
+
+def print_plan(plan, budget=None):
+    """
+    Print the estimated requests of each stage, and whether they fit in the
+    budget. Stages whose estimate is None are shown as unknown.
+    """
+    total = sum(requests for requests in plan.values() if requests is not None)
+    print("  Estimated requests:")
+    for stage, requests in plan.items():
+        print("    {:<12} {:>7}".format(stage, "?" if requests is None else requests))
+    print("    {:<12} {:>7}".format("total", total))
+    if None in plan.values():
+        print("  Stages marked ? can't be estimated yet, so the total is a lower bound")
+    if budget is not None and budget.remaining() is not None and total > budget.remaining():
+        print("  Only {} requests are left in the budget, so some artists will be searched next run".format(
+            budget.remaining()))
@@ -0,0 +1,171 @@
+"""
+Soltify/Radar/Pipeline
+
+Helper functions that run the taste update, release search and critic lookups
+of Soltify Radar at the same time, so the time spent waiting on one of them
+overlaps with the others instead of adding up
+"""
+import queue
+import threading
+
+from ..common import taste_profile
+from . import rating_finder
+
+# Maximum number of items waiting between two stages. When a stage falls
+# behind, the one feeding it waits instead of piling up work.
+PIPELINE_QUEUE_SIZE = 64
+
+# Number of artists whose releases are searched for at the same time
+RELEASE_WORKERS = 4
+
+# Maximum number of albums looked up by each call to find_critic_ratings()
+CRITIC_BATCH_SIZE = 20
+
+class _Stage:
+    """
+    A pool of threads that take items from a bounded queue and pass each one
+    to a function. An error in any thread is raised again by join().
+    """
+    def __init__(self, func, num_threads):
+        self.func = func
+        self.queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+        self.error = None
+        self.cancelled = False
+        self.threads = [threading.Thread(target=self._work, daemon=True) for i in range(num_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def cancel(self):
+        """
+        Drop the items that are still waiting (e.g. after an error or Ctrl-C
+        elsewhere), along with any put later, so join() doesn't wait for them
+        """
+        self.cancelled = True
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def join(self):
+        """
+        Wait for every queued item to be processed and stop the threads
+        """
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.error:
+            raise self.error
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            # After an error, keep emptying the queue so nothing feeding it blocks
+            if self.error or self.cancelled:
+                continue
+            try:
+                self.func(item)
+            except BaseException as err:
+                self.error = err
+
+class _CriticStage(_Stage):
+    """
+    A single thread that looks up critic ratings for albums in batches
+    """
+    def __init__(self):
+        super().__init__(None, 1)
+
+    def _work(self):
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            # Take whatever else is already waiting, up to a full batch
+            while len(batch) < CRITIC_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                done = True
+                batch = [album for album in batch if album is not None]
+            if batch and not self.error and not self.cancelled:
+                try:
+                    rating_finder.find_critic_ratings(batch)
+                except BaseException as err:
+                    self.error = err
+
+def run_pipeline(sp, songs, taste, taste_years, taste_pts0, taste_pts1, taste_thresh, min_time,
+                 album_releases, workers, show_progress, done=None, on_artist=None):
+    """
+    Update the taste profile with a list of new liked songs, search for new
+    releases by every artist whose taste score passes taste_thresh and look up
+    critic ratings for album_releases and every new album, all at once.
+
+    Taste scores only grow while liked songs are added, so an artist is
+    searched as soon as its score passes the threshold, while the rest of the
+    taste profile is still being updated. Its new albums go straight to the
+    critic lookups. Releases by artists whose final score doesn't pass the
+    threshold (e.g. with negative points) are dropped at the end.
+
+    done and on_artist are the set of artist ids already added to the taste
+    profile and the callback after each artist is added, as for
+    update_taste_profile().
+
+    Returns the filtered taste profile (as from sort_and_filter()) and the
+    unfiltered lists of new albums and singles, in taste score order.
+    """
+    critic_stage = _CriticStage()
+    for album in album_releases:
+        critic_stage.put(album)
+
+    found = dict()
+    found_lock = threading.Lock()
+    def search(artist_id):
+        albums, singles = sp.get_new_releases(artist_id, min_time)
+        with found_lock:
+            found[artist_id] = (albums, singles)
+        for album in albums:
+            critic_stage.put(album)
+    release_stage = _Stage(search, RELEASE_WORKERS)
+
+    # Only the main thread adds to searched
+    searched = set()
+    def on_update(taste, artist_ids):
+        for artist_id in artist_ids:
+            if artist_id in searched:
+                continue
+            entry = taste[artist_id]
+            if entry["liked_songs"] * taste_pts0 + entry["liked_related"] * taste_pts1 > taste_thresh:
+                searched.add(artist_id)
+                release_stage.put(artist_id)
+
+    try:
+        # Artists that already pass the threshold can be searched right away
+        on_update(taste, list(taste))
+        taste_profile.update_taste_profile(songs, taste, taste_years, sp, show_progress, done, on_artist,
+                                           workers, on_update)
+        taste_profile.assign_scores(taste, taste_pts0, taste_pts1)
+        taste_filtered = taste_profile.sort_and_filter(taste, taste_thresh)
+        on_update(taste, list(taste_filtered))
+    except BaseException:
+        # Don't wait for searches that haven't started
+        release_stage.cancel()
+        critic_stage.cancel()
+        raise
+    finally:
+        release_stage.join()
+        critic_stage.join()
+
+    albums = []
+    singles = []
+    for artist_id in taste_filtered:
+        artist_albums, artist_singles = found[artist_id]
+        albums.extend(artist_albums)
+        singles.extend(artist_singles)
+    return taste_filtered, albums, singles
@@ -4,7 +4,6 @@ Soltify/Radar/RatingFinder
 Helper functions that handle loading critic ratings from the internet
 (albumoftheyear.org)
 """
-import requests_html
 
 def find_critic_ratings(album_releases):
     """
@@ -20,11 +19,20 @@ def add_top_albums(album_releases, rating_threshold, min_time, genres):
     """
     print("TODO: add_top_albums()")
 
+def _create_session():
+    """
+    Create a session for loading pages from albumoftheyear.org.
+
+    requests_html pulls in pyppeteer and lxml, which are slow to import, so it is
+    only imported once we actually need to scrape something.
+    """
+    import requests_html
+    return requests_html.HTMLSession()
 
 """
 Note: the code below works
 
-self.sess = requests_html.HTMLSession()
+self.sess = _create_session()
 page = 1
 while True:
     if page == 1:
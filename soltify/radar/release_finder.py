@@ -4,7 +4,10 @@ Soltify/Radar/ReleaseFinder
 Helper functions that handle finding new releases from a list of artists via
 Spotify
 """
+import time
+
 from ..common import log
+from . import budget as budget_module
 
 # Index of each filter. These indices align allow_flags, FILTER_KEYWORDS,
 # and FILTER_NAMES
@@ -27,6 +30,16 @@ FILTER_KEYWORDS = [
 # Names of each filter that can be printed to the console
 FILTER_NAMES = ["remastered", "live", "acoustic", "remix", "cover"]
 
+# Ways find_releases() can search for new releases: scan each artist's
+# discography, or join Spotify's new release feed against the taste profile
+SCAN_STRATEGY_ARTIST = "artist"
+SCAN_STRATEGY_FEED   = "feed"
+SCAN_STRATEGIES = [SCAN_STRATEGY_ARTIST, SCAN_STRATEGY_FEED]
+
+# With the feed strategy, this many of the highest scoring artists are still
+# scanned one by one, since the feed doesn't list every release
+FEED_FALLBACK_ARTISTS = 50
+
 def build_list_from_playlist(playlist):
     """
     Build a release list from a Spotify playlist's contents
@@ -34,25 +47,95 @@ def build_list_from_playlist(playlist):
     print("TODO: build_list_from_playlist()")
     return []
 
-def find_releases(sp, taste, min_time, album_releases, single_releases, allow_flags, force_filter):
+def find_releases(sp, taste, min_time, album_releases, single_releases, allow_flags, force_filter,
+                  start_index=0, found=None, on_artist=None, budget=None, pending=None,
+                  strategy=SCAN_STRATEGY_ARTIST):
     """
     Search for new releases by artists in taste profile that came out between now
     and min_time. Certain types of releases (e.g. live, cover, remix) are filtered
     out unless the corresponding allow_flag is set. Unless force_filter=True,
     the user will be prompted for each one to confirm.
+
+    Artists are searched in the order of the taste profile (highest score
+    first), except that artists left over from the last run (pending) go first.
+    If a Budget is given, the search stops before any artist whose estimated
+    requests (or time, from the average so far) no longer fit in it.
+
+    To resume an interrupted search, pass in the index of the next artist to scan
+    (start_index) and the (albums, singles) found before that artist (found). If
+    on_artist is given, it is called as on_artist(next_index, albums, singles)
+    after each artist is scanned.
+
+    With strategy=SCAN_STRATEGY_FEED, Spotify's new release feed is joined
+    against the taste profile first, and only pending artists and the
+    FEED_FALLBACK_ARTISTS highest scoring artists are scanned one by one. Reading
+    the feed counts as the first artist for start_index and on_artist.
+
+    Returns the list of artist ids that weren't searched because the budget ran
+    out, to be passed back in as pending on the next run.
     """
+    order = list(_scan_order(taste, pending))
+    if found:
+        albums, singles = found
+    else:
+        albums = []
+        singles = []
+
+    feed_steps = 0
+    if strategy == SCAN_STRATEGY_FEED:
+        fallback = set(list(taste)[:FEED_FALLBACK_ARTISTS]) | set(pending or [])
+        order = [artist_id for artist_id in order if artist_id in fallback]
+        feed_steps = 1
+        if start_index == 0:
+            if budget and not budget.can_afford(budget_module.FEED_REQUESTS):
+                log.warning("Budget too small to read the new release feed; only the top artists will be searched")
+            else:
+                feed_albums, feed_singles = _join_feed(sp.get_release_feed(min_time), taste, fallback)
+                albums.extend(feed_albums)
+                singles.extend(feed_singles)
+            if on_artist:
+                on_artist(feed_steps, albums, singles)
+        start_index = max(start_index - feed_steps, 0)
 
     # First, just gather a list of releases
-    total = len(taste)
-    albums = []
-    singles = []
-    log.show_progress(0, total)
-    for i, artist_id in enumerate(taste):
-        albums.extend(sp.get_new_albums(artist_id, min_time, False))
-        singles.extend(sp.get_new_albums(artist_id, min_time, True))
+    total = len(order)
+    unscanned = []
+    start_time = time.time()
+    log.show_progress(min(start_index, total), total)
+    for i, artist_id in enumerate(order):
+        if i < start_index:
+            continue
+        if budget:
+            scanned = i - start_index
+            seconds = (time.time() - start_time) / scanned if scanned else 0.0
+            if not budget.can_afford(budget_module.release_requests(taste[artist_id]), seconds):
+                unscanned = order[i:]
+                log.show_progress(total, total)
+                log.warning("Budget used up; {} artists will be searched next run".format(len(unscanned)))
+                break
+        start_requests = sp.request_count()
+        artist_albums, artist_singles = sp.get_new_releases(artist_id, min_time)
+        albums.extend(artist_albums)
+        singles.extend(artist_singles)
+        # Remember how many requests this artist took to plan the next run
+        # (none means the releases were cached, which says nothing about next time)
+        requests = sp.request_count() - start_requests
+        if requests:
+            taste[artist_id]["release_requests"] = requests
+        if on_artist:
+            on_artist(i+1+feed_steps, albums, singles)
         log.show_progress(i+1, total)
 
-    # If any were found, run them through the filters
+    filter_releases(albums, singles, album_releases, single_releases, allow_flags, force_filter)
+    return unscanned
+
+def filter_releases(albums, singles, album_releases, single_releases, allow_flags, force_filter):
+    """
+    Run newly found albums and singles through the filters and add the ones
+    that pass to album_releases and single_releases. Unless force_filter=True,
+    the user will be prompted for each one to confirm, so this must be called
+    from the main thread.
+    """
     if albums:
         print("  NEW ALBUMS:")
         print("  -----------------")
@@ -69,6 +152,47 @@ def find_releases(sp, taste, min_time, album_releases, single_releases, allow_fl
                 single_releases.append(single)
         print("")
 
+def _scan_order(taste, pending):
+    """
+    Get the artist ids of a taste profile in the order to search them: pending
+    artists (that are still in the profile) first, then the rest
+    """
+    pending = [artist_id for artist_id in (pending or []) if artist_id in taste]
+    pending_set = set(pending)
+    yield from pending
+    for artist_id in taste:
+        if not artist_id in pending_set:
+            yield artist_id
+
+def _join_feed(feed, taste, skip):
+    """
+    Join the releases of a new release feed against the artists of a taste
+    profile (except those in skip) by artist id. Returns the (albums, singles)
+    found, in taste profile order.
+    """
+    releases_by_artist = dict()
+    for release in feed:
+        for artist_id in release["artist_ids"]:
+            releases_by_artist.setdefault(artist_id, []).append(release)
+
+    albums = []
+    singles = []
+    for artist_id in taste:
+        if artist_id in skip:
+            continue
+        for release in releases_by_artist.get(artist_id, []):
+            entry = {
+                "name": release["name"],
+                "artist": release["artist"],
+                "id": release["id"],
+                "release_date": release["release_date"]
+            }
+            if release["single"]:
+                singles.append(entry)
+            else:
+                albums.append(entry)
+    return albums, singles
+
 def _check_filters(release, allow_flags, force_filter):
     """
     Check if this release against all enabled filters and return True if it passes
@@ -0,0 +1,205 @@
+"""
+Soltify/Radar/Sweep
+
+Helper functions that evaluate many taste scoring parameters at once against a
+cached library and taste profile, without connecting to Spotify.
+
+numpy is used to evaluate every combination in one batch when it is installed;
+otherwise each combination is evaluated in plain python.
+"""
+import copy
+import itertools
+from datetime import datetime, timedelta
+
+from . import budget
+from ..common import song_table
+from ..common import taste_profile
+
+class TasteGraph:
+    """
+    The parts of a library and taste profile that taste scores are computed
+    from: which artist each liked song is by (and when it was released), and
+    which artists each artist is related to
+    """
+    def __init__(self, songs, taste):
+        self.taste = taste
+        self.artist_ids = list(taste)
+        names = {artist_id: entry["artist_name"] for artist_id, entry in taste.items()}
+        position = {artist_id: i for i, artist_id in enumerate(self.artist_ids)}
+        # Artists of songs that were outside the taste window aren't in the
+        # profile yet
+        for song in songs:
+            if not song["artist_id"] in position:
+                position[song["artist_id"]] = len(self.artist_ids)
+                self.artist_ids.append(song["artist_id"])
+                names[song["artist_id"]] = song["artist"]
+        self.names = [names[artist_id] for artist_id in self.artist_ids]
+        self.position = position
+
+        # Each window of songs is looked up in the release date index
+        self.songs = song_table.SongTable(songs)
+
+        # One edge from each artist to each of its related artists
+        self.edge_sources = []
+        self.edge_targets = []
+        for artist_id, entry in taste.items():
+            for related in entry["related_artists"]:
+                if related in position:
+                    self.edge_sources.append(position[artist_id])
+                    self.edge_targets.append(position[related])
+        self.has_related = [artist_id in taste and bool(taste[artist_id]["related_artists"])
+                            for artist_id in self.artist_ids]
+
+        # Estimated requests to search each artist's releases
+        self.costs = [budget.release_requests(taste[artist_id]) if artist_id in taste
+                      else budget.DEFAULT_RELEASE_REQUESTS for artist_id in self.artist_ids]
+
+    def counts(self, taste_years, now=None):
+        """
+        Get the liked songs and liked related songs of each artist, counting
+        only songs released within taste_years, as update_taste_profile() would
+        """
+        if now is None:
+            now = datetime.now()
+        min_release_date = now - timedelta(days=365.25*taste_years)
+        liked = [0] * len(self.artist_ids)
+        for artist_id, count in self.songs.artist_counts(min_release_date)[0].items():
+            liked[self.position[artist_id]] = count
+        related = [0] * len(self.artist_ids)
+        for source, target in zip(self.edge_sources, self.edge_targets):
+            related[target] += liked[source]
+        return liked, related
+
+    def missing_related(self, liked):
+        """
+        Count the artists with liked songs whose related artists were never
+        fetched (their related songs are missing from every score)
+        """
+        return sum(1 for count, has_related in zip(liked, self.has_related) if count and not has_related)
+
+def evaluate(graph, taste_pts0, taste_pts1, taste_thresh, taste_years, baseline, now=None):
+    """
+    Evaluate every combination of the lists of scoring parameters. baseline is
+    a (taste_pts0, taste_pts1, taste_thresh, taste_years) tuple that the
+    artists passing each combination are compared against.
+
+    Returns a list with one dictionary per combination: the parameters, the
+    number of artists that pass (artists), how many of them also pass the
+    baseline (overlap), the Jaccard similarity of the two sets (jaccard) and
+    the estimated requests to search their releases (requests).
+    """
+    numpy = _import_numpy()
+    if numpy is None:
+        evaluate_years = _evaluate_years_python
+    else:
+        evaluate_years = _evaluate_years_numpy
+
+    pts0_0, pts1_0, thresh_0, years_0 = baseline
+    liked, related = graph.counts(years_0, now)
+    base = [liked[i] * pts0_0 + related[i] * pts1_0 > thresh_0 for i in range(len(liked))]
+
+    results = []
+    for years in taste_years:
+        liked, related = graph.counts(years, now)
+        for pts0, pts1, thresh, artists, overlap, requests in evaluate_years(
+                liked, related, graph.costs, base, taste_pts0, taste_pts1, taste_thresh):
+            union = artists + sum(base) - overlap
+            results.append({
+                "taste_pts0": pts0,
+                "taste_pts1": pts1,
+                "taste_thresh": thresh,
+                "taste_years": years,
+                "artists": artists,
+                "overlap": overlap,
+                "jaccard": overlap / union if union else 1.0,
+                "requests": requests,
+            })
+    return results
+
+def choose(results, target_artists=None, max_requests=None):
+    """
+    Choose the best combination: the one with the number of passing artists
+    closest to target_artists, or the most artists that fit in max_requests.
+    Ties go to the combination that overlaps most with the baseline. Returns
+    None if nothing fits.
+    """
+    candidates = results
+    if max_requests is not None:
+        candidates = [result for result in results if result["requests"] <= max_requests]
+    if not candidates:
+        return None
+    if target_artists is not None:
+        return min(candidates, key=lambda result: (abs(result["artists"] - target_artists), -result["jaccard"]))
+    return max(candidates, key=lambda result: (result["artists"], result["jaccard"]))
+
+def build_taste(graph, result, now=None):
+    """
+    Build the filtered taste profile (as from sort_and_filter()) for one
+    combination
+    """
+    liked, related = graph.counts(result["taste_years"], now)
+    taste = dict()
+    for i, artist_id in enumerate(graph.artist_ids):
+        if artist_id in graph.taste:
+            entry = copy.copy(graph.taste[artist_id])
+        else:
+            entry = {"artist_name": graph.names[i], "score": 0.0, "related_artists": []}
+        entry["liked_songs"] = liked[i]
+        entry["liked_related"] = related[i]
+        taste[artist_id] = entry
+    taste_profile.assign_scores(taste, result["taste_pts0"], result["taste_pts1"])
+    return taste_profile.sort_and_filter(taste, result["taste_thresh"])
+
+################################################################################
+# Private Functions
+################################################################################
+def _import_numpy():
+    """
+    Import numpy if it is installed, otherwise return None
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def _evaluate_years_numpy(liked, related, costs, base, taste_pts0, taste_pts1, taste_thresh):
+    """
+    Evaluate every (taste_pts0, taste_pts1, taste_thresh) combination for one
+    window of songs in a single batch
+    """
+    import numpy
+    liked = numpy.asarray(liked, dtype=float)
+    related = numpy.asarray(related, dtype=float)
+    costs = numpy.asarray(costs, dtype=float)
+    base = numpy.asarray(base, dtype=bool)
+    pts0 = numpy.asarray(taste_pts0, dtype=float)
+    pts1 = numpy.asarray(taste_pts1, dtype=float)
+    thresh = numpy.asarray(taste_thresh, dtype=float)
+
+    # scores[p0, p1, artist], passing[p0, p1, thresh, artist]
+    scores = pts0[:, None, None] * liked + pts1[None, :, None] * related
+    passing = scores[:, :, None, :] > thresh[None, None, :, None]
+    artists = passing.sum(axis=-1)
+    overlap = (passing & base).sum(axis=-1)
+    requests = passing @ costs
+
+    for i, j, k in itertools.product(range(len(pts0)), range(len(pts1)), range(len(thresh))):
+        yield (taste_pts0[i], taste_pts1[j], taste_thresh[k], int(artists[i, j, k]), int(overlap[i, j, k]),
+               int(requests[i, j, k]))
+
+def _evaluate_years_python(liked, related, costs, base, taste_pts0, taste_pts1, taste_thresh):
+    """
+    Evaluate every (taste_pts0, taste_pts1, taste_thresh) combination for one
+    window of songs, one at a time
+    """
+    for pts0, pts1 in itertools.product(taste_pts0, taste_pts1):
+        scores = [l * pts0 + r * pts1 for l, r in zip(liked, related)]
+        for thresh in taste_thresh:
+            artists = overlap = requests = 0
+            for score, cost, in_base in zip(scores, costs, base):
+                if score > thresh:
+                    artists += 1
+                    overlap += in_base
+                    requests += cost
+            yield pts0, pts1, thresh, artists, overlap, requests
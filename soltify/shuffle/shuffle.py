@@ -3,70 +3,143 @@ Soltify/Shuffle/Shuffle
 
 Helper functions that handle shuffling a list of songs
 """
+import heapq
 import random
 
-def _bin_songs_by_artist(songs):
+# Functions that get the value of each key songs can be spaced out by. Artist
+# and album names are compared case-insensitively so the same primary artist
+# under different artist ids is still spread out.
+SPACING_KEYS = {
+    "artist": lambda song: song["artist"].lower(),
+    "artist_id": lambda song: song["artist_id"],
+    "album": lambda song: (song["artist"].lower(), song["album"].lower()),
+    "year": lambda song: song["release_date"].year,
+}
+
+# Default list of (key, weight) pairs to space songs out by
+DEFAULT_SPACING = [("artist", 1.0)]
+
+# Number of next-due songs compared against all spacing keys when choosing
+# each position. Higher spaces secondary keys better but runs slower.
+SPACING_CANDIDATES = 4
+
+def _bin_songs_by_key(songs, key_func):
     """
-    Organize songs into bins by the artist name
+    Organize songs into bins by the value of a spacing key
     """
     bins = dict()
     for song in songs:
-        artist = song["artist"]
-        if not artist in bins:
-            bins[artist] = []
-        bins[artist].append(song)
+        value = key_func(song)
+        if not value in bins:
+            bins[value] = []
+        bins[value].append(song)
     return bins
 
-def _sort_bins_by_size(bins):
+def shuffle(songs, ignore_artist, spacing=None):
     """
-    Sort bins from largest to smallest
+    Shuffle a list of songs. By default, this is a pseudo-random shuffle that
+    intentionally spaces songs by the same artist out.  If ignore_artist=True,
+    then it is purely pseudo-random.
+
+    spacing is a list of (key, weight) pairs, where key is one of SPACING_KEYS,
+    that songs are spread out by at the same time (e.g. artist, then album,
+    then release year). The first key is spaced exactly; the weights decide
+    which of the others matter most when they conflict.
     """
-    bins = dict(sorted(bins.items(), key=lambda item:-len(item[1])))
-    return bins
+    if ignore_artist:
+        shuffled = list(songs)
+        random.shuffle(shuffled)
+        return shuffled
 
+    if spacing is None:
+        spacing = DEFAULT_SPACING
+    return _spread(list(songs), spacing)
 
-def shuffle(songs, ignore_artist):
+################################################################################
+# Private Functions
+################################################################################
+def _spread(songs, spacing):
     """
-    Shuffle a list of songs. By default, this is a pseudo-random shuffle that
-    intentionally spaces songs by the same artist out.  If ignore_artist=True,
-    then it is purely pseudo-random.
+    Order songs so that songs with the same value of each spacing key are as
+    evenly spaced out as possible.
+
+    Songs are binned by the first key, and each bin is ordered (recursively) by
+    the remaining keys. Each bin then gets evenly spaced target positions across
+    the list, starting at a random offset, and a heap of bins sorted by their
+    next target position decides which bin fills each position. Of the few bins
+    that are due next, the one whose song is furthest from other songs sharing
+    its key values is chosen. With k bins this runs in O(n log k).
     """
-    
-    # Create a list of available indices for final list and a blank list
     num_songs = len(songs)
-    indices = [i for i in range(0, num_songs)]
-    shuffled = [None] * num_songs
+    if not spacing:
+        random.shuffle(songs)
+        return songs
 
-    bins = dict()
-    if ignore_artist:
-        # Add songs to the shuffled list in a random order
+    key_funcs = [SPACING_KEYS[key] for key, weight in spacing]
+    weights = [weight for key, weight in spacing]
+
+    # target_spacing: if a key value was evenly distributed across the playlist,
+    # there would be one song with it every target_spacing songs.
+    target_spacing = []
+    for key_func in key_funcs:
+        counts = dict()
         for song in songs:
-            index = random.choice(indices)
-            indices.remove(index)
-            shuffled[index] = song
-    else:
-        # Bin songs by artist
-        bins = _bin_songs_by_artist(songs)
-        bins = _sort_bins_by_size(bins)
-        # For each artist (starting with the largest bin)
-        for artist, songlist in bins.items():
-            # target_spacing: if this artist was evenly distributed across the
-            # playlist, there would be one song by them every target_spacing songs.
-            target_spacing = len(indices)/len(songlist)
-            # To choose the location of the first song by this artist, choose
-            # any random index between 0 and target_spacing
-            i = random.randint(0, int(target_spacing)-1)
-            while songlist:
-                # Get the i-th remaining index.
-                index = indices[int(i)]
-                # Choose a random song from the bin
-                song = random.choice(songlist)
-                songlist.remove(song)
-                # Add it at the chosen index
-                shuffled[index] = song
-                indices.remove(index)
-                i -= 1  # Because indices lost an element
-                # After 1st song, space the songs evenly across the remaining
-                # playlist
-                i += target_spacing
+            value = key_func(song)
+            counts[value] = counts.get(value, 0) + 1
+        target_spacing.append({value: num_songs / count for value, count in counts.items()})
+
+    # Bin songs by the first key and spread each bin by the remaining keys
+    bins = [_spread(songlist, spacing[1:]) for songlist in
+            _bin_songs_by_key(songs, key_funcs[0]).values()]
+
+    # To choose the location of the first song in each bin, choose any random
+    # position between 0 and target_spacing
+    strides = [num_songs / len(songlist) for songlist in bins]
+    heap = [(random.uniform(0, stride), random.random(), bin_idx, 0) for bin_idx, stride in enumerate(strides)]
+    heapq.heapify(heap)
+
+    last_position = [dict() for key_func in key_funcs]
+    shuffled = []
+    for position in range(num_songs):
+        # Take the bins that are due next and choose the one whose song is the
+        # least close to other songs sharing any of its key values. Bins that
+        # aren't due yet are penalized for going early, so no bin falls behind.
+        candidates = [heapq.heappop(heap) for i in range(min(SPACING_CANDIDATES, len(heap)))]
+        def score(candidate):
+            target, tiebreak, bin_idx, song_idx = candidate
+            early = max(0.0, target - position) / strides[bin_idx]
+            closeness = _closeness(bins[bin_idx][song_idx], position, key_funcs, weights,
+                                   target_spacing, last_position)
+            return (closeness + weights[0] * early, target)
+        best = min(range(len(candidates)), key=lambda i: score(candidates[i]))
+        target, tiebreak, bin_idx, song_idx = candidates.pop(best)
+        for candidate in candidates:
+            heapq.heappush(heap, candidate)
+
+        song = bins[bin_idx][song_idx]
+        shuffled.append(song)
+        for key_idx, key_func in enumerate(key_funcs):
+            last_position[key_idx][key_func(song)] = position
+
+        # After each song, its bin's next target is spaced evenly across the
+        # playlist
+        if song_idx + 1 < len(bins[bin_idx]):
+            heapq.heappush(heap, (target + strides[bin_idx], tiebreak, bin_idx, song_idx + 1))
     return shuffled
+
+def _closeness(song, position, key_funcs, weights, target_spacing, last_position):
+    """
+    Score how close a song would be to the last song sharing each of its key
+    values if it were placed at position. 0 means every key value is at least
+    its target spacing away; each key adds up to its weight.
+    """
+    score = 0.0
+    for key_idx, key_func in enumerate(key_funcs):
+        value = key_func(song)
+        last = last_position[key_idx].get(value)
+        if last is not None:
+            distance = position - last
+            target = target_spacing[key_idx][value]
+            if distance < target:
+                score += weights[key_idx] * (1.0 - distance / target)
+    return score
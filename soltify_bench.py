@@ -0,0 +1,490 @@
+"""
+Soltify Bench
+
+Script to benchmark each stage of the Soltify tools without a live Spotify
+account, using either a generated library of any size or responses recorded
+from a real account (see --record on the other tools). Results are appended to
+a history file so performance can be tracked over time.
+
+Run with -h option for usage.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from soltify.common import file_manager
+from soltify.common import spotify
+from soltify.common import replay
+from soltify.common import taste_profile
+
+from soltify.radar import pipeline
+from soltify.radar import release_finder
+from soltify.shuffle import shuffle
+
+from soltify.bench import synthetic
+
+# Stages that can be benchmarked, in the order they run
+# (feed runs the releases stage again with --scan-strategy=feed, and pipeline
+# runs the taste and releases stages again, at the same time, as
+# soltify_radar.py --pipeline does)
+STAGES = ["library", "taste", "releases", "feed", "pipeline", "shuffle"]
+
+# Library sizes benchmarked by default
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+# Entry points whose startup time is measured with --startup
+STARTUP_MODULES = ["soltify_radar", "soltify_shuffle"]
+
+# Number of times each entry point is started with --startup
+STARTUP_REPEATS = 5
+
+# Number of slowest imports listed for each entry point with --startup
+STARTUP_TOP_IMPORTS = 5
+
+# Playlist sizes and spacing settings benchmarked with --spacing
+SPACING_SIZES = [1000, 10000, 50000]
+SPACING_CONFIGS = {
+    "random": None,
+    "artist": [("artist", 1.0)],
+    "artist+album+year": [("artist", 1.0), ("album", 0.5), ("year", 0.2)],
+}
+
+# Keys that spacing quality is measured for with --spacing
+SPACING_QUALITY_KEYS = ["artist", "album", "year"]
+
+# Library sizes benchmarked with --cache, and the bandwidth (in megabits per
+# second) of the network drive the time to copy each cache is estimated for
+CACHE_SIZES = [10000, 100000]
+CACHE_BANDWIDTH_MBPS = 100.0
+
+# Default scoring parameters (same as soltify_radar.py)
+TASTE_YEARS = 15
+TASTE_PTS0 = 1.0
+TASTE_PTS1 = 0.2
+TASTE_THRESH = 2.0
+MAX_DAYS = 60
+
+def main():
+    parser = argparse.ArgumentParser(
+      description='Soltify Bench: time each stage of the Soltify tools offline')
+
+    source_group = parser.add_argument_group("data options")
+    source_group.add_argument("--sizes", type=int, nargs='+', default=DEFAULT_SIZES,
+        help="Number of tracks in each generated library to benchmark [default:{}]".format(
+            " ".join(str(s) for s in DEFAULT_SIZES)))
+    source_group.add_argument("--seed", type=int, default=0,
+        help="Seed used to generate libraries [default:0]")
+    source_group.add_argument("--replay", type=str,
+        help="Benchmark against responses recorded with --record instead of a generated library")
+    source_group.add_argument("--playlist", type=str, default=synthetic.SYNTHETIC_PLAYLIST_NAME,
+        help="Playlist to shuffle in the shuffle stage (only needed with --replay)")
+    source_group.add_argument("--stages", nargs='+', choices=STAGES, default=STAGES,
+        help="Stages to benchmark [default:all]")
+    source_group.add_argument("--startup", action="store_true",
+        help="Benchmark how long it takes to start each tool instead of running any stages")
+    source_group.add_argument("--spacing", action="store_true",
+        help="Benchmark the speed and spacing quality of the shuffle engine instead of running any stages")
+    source_group.add_argument("--cache", action="store_true",
+        help="Benchmark the size, save time and load time of the library cache with each codec instead of running any stages")
+
+    latency_group = parser.add_argument_group("network latency model")
+    latency_group.add_argument("--latency-ms", type=float, default=100.0,
+        help="Round trip time of each request in milliseconds [default:100]")
+    latency_group.add_argument("--per-kb-ms", type=float, default=0.05,
+        help="Transfer time per KB of response in milliseconds [default:0.05]")
+    latency_group.add_argument("--jitter-ms", type=float, default=20.0,
+        help="Maximum random extra time per request in milliseconds [default:20]")
+    latency_group.add_argument("--sleep", action="store_true",
+        help="Actually wait for the simulated latency instead of just adding it up")
+
+    output_group = parser.add_argument_group("output options")
+    output_group.add_argument("--history", type=str, default="soltify_bench_history.jsonl",
+        help="File that results are appended to (default=soltify_bench_history.jsonl)")
+
+    args = parser.parse_args()
+
+    history = _load_history(args.history)
+    if args.startup:
+        print("Benchmarking startup...")
+        record = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "commit": _get_commit(),
+            "source": "startup",
+            "latency": None,
+            "stages": run_startup(),
+        }
+        _print_startup_results(record, _find_previous(history, record))
+        _append_history(args.history, record)
+        return
+
+    if args.spacing:
+        for size in SPACING_SIZES:
+            print("Benchmarking spacing of {} songs...".format(size))
+            record = {
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "commit": _get_commit(),
+                "source": "spacing:{}".format(size),
+                "latency": None,
+                "stages": run_spacing(size, args.seed),
+            }
+            _print_spacing_results(record, _find_previous(history, record))
+            history.append(record)
+            _append_history(args.history, record)
+        return
+
+    if args.cache:
+        for size in CACHE_SIZES:
+            print("Benchmarking cache of {} songs...".format(size))
+            record = {
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "commit": _get_commit(),
+                "source": "cache:{}".format(size),
+                "latency": None,
+                "stages": run_cache(size, args.seed),
+            }
+            _print_cache_results(record, _find_previous(history, record))
+            history.append(record)
+            _append_history(args.history, record)
+        return
+
+    if args.replay:
+        runs = [("replay:" + os.path.basename(args.replay), None)]
+    else:
+        runs = [("synthetic:{}".format(size), size) for size in args.sizes]
+
+    for source, size in runs:
+        print("Benchmarking {}...".format(source))
+        latency = replay.LatencyModel(args.latency_ms, args.per_kb_ms, args.jitter_ms, args.sleep, args.seed)
+        if size is None:
+            client = replay.ReplayClient(args.replay, latency)
+        else:
+            client = synthetic.SyntheticClient(size, args.seed, latency)
+        results = run_stages(client, latency, args.stages, args.playlist)
+
+        record = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "commit": _get_commit(),
+            "source": source,
+            "latency": [args.latency_ms, args.per_kb_ms, args.jitter_ms, args.sleep],
+            "stages": results,
+        }
+        _print_results(record, _find_previous(history, record))
+        history.append(record)
+        _append_history(args.history, record)
+
+def run_stages(client, latency, stages, playlist_name):
+    """
+    Run each stage against a fake spotipy client and return a dictionary of
+    timings for each one
+    """
+    sp = spotify.Spotify()
+    sp.sp = client
+    results = dict()
+    songs = []
+    taste = dict()
+    taste_filtered = dict()
+
+    for stage in STAGES:
+        if not stage in stages:
+            continue
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        start_network = latency.network_time
+        start_threads = latency.thread_times()
+        start_requests = client.request_count
+        # Hide the console output of each stage so it isn't part of the timing
+        with contextlib.redirect_stdout(io.StringIO()):
+            if stage == "library":
+                songs = sp.load_library([], False)
+            elif stage == "taste":
+                taste_profile.update_taste_profile(songs, taste, TASTE_YEARS, sp, False)
+                taste_profile.assign_scores(taste, TASTE_PTS0, TASTE_PTS1)
+                taste_filtered = taste_profile.sort_and_filter(taste, TASTE_THRESH)
+            elif stage == "releases":
+                min_time = datetime.now() - timedelta(days=MAX_DAYS)
+                allow_flags = [False] * len(release_finder.FILTER_NAMES)
+                release_finder.find_releases(sp, taste_filtered, min_time, [], [], allow_flags, True)
+            elif stage == "feed":
+                min_time = datetime.now() - timedelta(days=MAX_DAYS)
+                allow_flags = [False] * len(release_finder.FILTER_NAMES)
+                release_finder.find_releases(sp, taste_filtered, min_time, [], [], allow_flags, True,
+                                             strategy=release_finder.SCAN_STRATEGY_FEED)
+            elif stage == "pipeline":
+                min_time = datetime.now() - timedelta(days=MAX_DAYS)
+                pipeline.run_pipeline(sp, songs, dict(), TASTE_YEARS, TASTE_PTS0, TASTE_PTS1, TASTE_THRESH,
+                                      min_time, [], taste_profile.RELATED_ARTIST_WORKERS, False)
+            elif stage == "shuffle":
+                # Find the playlist the same way soltify_shuffle.py does, so
+                # recordings of it can be replayed
+                playlist_uri = sp.find_playlists([playlist_name]).get(playlist_name)
+                if playlist_uri is None:
+                    raise RuntimeError("No playlist with name {} found in user library".format(playlist_name))
+                playlist, playlist_uri = sp.load_playlist(playlist_name, playlist_uri)
+                playlist = shuffle.shuffle(playlist, False)
+                sp.write_playlist(playlist_uri, playlist, overwrite=True)
+        wall = time.perf_counter() - start_wall
+        network = latency.network_time - start_network
+        # Threads wait on the network at the same time, so the stage waits
+        # about as long as the thread that spent the most time waiting. It
+        # can't beat Spotify's rate limit though, which fake clients bypass.
+        requests = client.request_count - start_requests
+        concurrent_network = max([seconds - start_threads.get(thread, 0.0)
+                                  for thread, seconds in latency.thread_times().items()], default=0.0)
+        concurrent_network = max(concurrent_network, spotify.rate_limited_seconds(requests))
+        results[stage] = {
+            "wall_s": wall,
+            "cpu_s": time.process_time() - start_cpu,
+            "network_s": network,
+            # When latency is only simulated, the real run would also have had
+            # to wait for the network
+            "modeled_s": wall if latency.sleep else wall + concurrent_network,
+            "requests": requests,
+        }
+    return results
+
+def run_startup():
+    """
+    Time how long it takes to import each tool's entry point in a new python
+    process (everything that runs before main() does), and find the slowest
+    imports
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = dict()
+    for module in STARTUP_MODULES:
+        command = [sys.executable, "-c", "import " + module]
+        times = []
+        for i in range(STARTUP_REPEATS):
+            start = time.perf_counter()
+            subprocess.run(command, cwd=directory, check=True)
+            times.append(time.perf_counter() - start)
+
+        # Run once more with python's import profiler
+        command = [sys.executable, "-X", "importtime", "-c", "import " + module]
+        output = subprocess.run(command, cwd=directory, check=True, capture_output=True, text=True)
+        results[module] = {
+            "wall_s": statistics.median(times),
+            "top_imports": _parse_import_times(output.stderr, module),
+        }
+    return results
+
+def run_spacing(size, seed):
+    """
+    Shuffle a generated playlist with each of SPACING_CONFIGS and measure how
+    long it took and how well songs sharing each key were spread out
+    """
+    sp = spotify.Spotify()
+    sp.sp = synthetic.SyntheticClient(size, seed)
+    songs, playlist_uri = sp.load_playlist(synthetic.SYNTHETIC_PLAYLIST_NAME)
+
+    results = dict()
+    for name, spacing in SPACING_CONFIGS.items():
+        start = time.process_time()
+        shuffled = shuffle.shuffle(songs, spacing is None, spacing)
+        results[name] = {"cpu_s": time.process_time() - start}
+        for key in SPACING_QUALITY_KEYS:
+            results[name][key] = _measure_spacing(shuffled, shuffle.SPACING_KEYS[key])
+    return results
+
+def run_cache(size, seed):
+    """
+    Save and load a generated library in the cache with each available codec
+    and measure the size of the files and how long it took
+    """
+    sp = spotify.Spotify()
+    sp.sp = synthetic.SyntheticClient(size, seed)
+    songs = sp.load_library([], False)
+
+    results = dict()
+    for codec in file_manager.available_codecs():
+        with tempfile.TemporaryDirectory() as directory:
+            file_manager.set_cache_codec(directory, codec)
+            start = time.perf_counter()
+            file_manager.save_library(directory, songs, dict(), datetime.now())
+            save_s = time.perf_counter() - start
+
+            num_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+            file_manager.forget_catalogs()
+            start = time.perf_counter()
+            file_manager.load_library(directory)
+            load_s = time.perf_counter() - start
+            file_manager.forget_catalogs()
+
+        results[codec] = {
+            "bytes": num_bytes,
+            "save_s": save_s,
+            "load_s": load_s,
+            "transfer_s": num_bytes * 8 / (CACHE_BANDWIDTH_MBPS * 1000000),
+        }
+    return results
+
+################################################################################
+# Private Functions
+################################################################################
+def _measure_spacing(songs, key_func):
+    """
+    Measure how evenly songs sharing a key value are spread out. Returns the
+    average gap between consecutive songs with the same value as a fraction of
+    the even spacing for that value (capped at 1.0, so 1.0 is perfect), and the
+    number of back-to-back songs with the same value.
+    """
+    values = [key_func(song) for song in songs]
+    counts = dict()
+    for value in values:
+        counts[value] = counts.get(value, 0) + 1
+
+    last_position = dict()
+    total_score = 0.0
+    num_gaps = 0
+    adjacent = 0
+    for position, value in enumerate(values):
+        if value in last_position:
+            gap = position - last_position[value]
+            total_score += min(1.0, gap / (len(values) / counts[value]))
+            num_gaps += 1
+            adjacent += int(gap == 1)
+        last_position[value] = position
+    score = total_score / num_gaps if num_gaps else 1.0
+    return {"spread": score, "adjacent": adjacent}
+
+def _print_spacing_results(record, previous):
+    """
+    Print the speed and spacing quality of each spacing setting, with the
+    change in speed since the previous run with the same size
+    """
+    print("  {:<20} {:>8} {:>8}".format("Spacing", "CPU s", "Change") +
+          "".join(" {:>18}".format(key + " spread/adj") for key in SPACING_QUALITY_KEYS))
+    for name, result in record["stages"].items():
+        change = ""
+        if previous and name in previous["stages"] and previous["stages"][name]["cpu_s"] > 0:
+            ratio = result["cpu_s"] / previous["stages"][name]["cpu_s"]
+            change = "{:+.1f}%".format((ratio - 1.0) * 100.0)
+        quality = "".join(" {:>12.3f}/{:<5}".format(result[key]["spread"], result[key]["adjacent"])
+                          for key in SPACING_QUALITY_KEYS)
+        print("  {:<20} {:>8.3f} {:>8}".format(name, result["cpu_s"], change) + quality)
+
+def _print_cache_results(record, previous):
+    """
+    Print the size and speed of the cache with each codec, with the change in
+    load time since the previous run with the same size
+    """
+    print("  {:<8} {:>10} {:>8} {:>8} {:>12} {:>8}".format(
+        "Codec", "MB", "Save s", "Load s", "Transfer s", "Change"))
+    for codec, result in record["stages"].items():
+        change = ""
+        if previous and codec in previous["stages"] and previous["stages"][codec]["load_s"] > 0:
+            ratio = result["load_s"] / previous["stages"][codec]["load_s"]
+            change = "{:+.1f}%".format((ratio - 1.0) * 100.0)
+        print("  {:<8} {:>10.2f} {:>8.3f} {:>8.3f} {:>12.3f} {:>8}".format(
+            codec, result["bytes"] / 1000000, result["save_s"], result["load_s"], result["transfer_s"], change))
+
+def _parse_import_times(output, module):
+    """
+    Get the slowest imports made by a module (and how many milliseconds each
+    took, including everything it imported) from the output of
+    python -X importtime
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        name = fields[2].rstrip()
+        # Each level of nesting is indented by 2 more spaces
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), depth, int(fields[1]) / 1000.0))
+
+    # A module's imports are listed right before it, so walk backwards from it
+    # to find its direct imports
+    imports = []
+    names = [entry[0] for entry in entries]
+    if module in names:
+        for name, depth, ms in reversed(entries[:names.index(module)]):
+            if depth == 0:
+                break
+            if depth == 1:
+                imports.append([name, ms])
+    imports.sort(key=lambda entry: entry[1], reverse=True)
+    return imports[:STARTUP_TOP_IMPORTS]
+
+def _print_startup_results(record, previous):
+    """
+    Print the startup time of each tool, compared to the previous startup
+    benchmark if there is one
+    """
+    for module, result in record["stages"].items():
+        change = ""
+        if previous and module in previous["stages"]:
+            ratio = result["wall_s"] / previous["stages"][module]["wall_s"]
+            change = " ({:+.1f}%)".format((ratio - 1.0) * 100.0)
+        print("  {}: {:.3f} s{}".format(module, result["wall_s"], change))
+        for name, ms in result["top_imports"]:
+            print("    {:<30} {:>8.1f} ms".format(name, ms))
+
+def _print_results(record, previous):
+    """
+    Print a table of results for one benchmark run, compared to the previous
+    run with the same settings if there is one
+    """
+    print("  {:<10} {:>10} {:>10} {:>12} {:>12} {:>10}".format(
+        "Stage", "Requests", "CPU s", "Network s", "Modeled s", "Change"))
+    for stage, result in record["stages"].items():
+        change = ""
+        if previous and stage in previous["stages"] and previous["stages"][stage]["cpu_s"] > 0:
+            ratio = result["cpu_s"] / previous["stages"][stage]["cpu_s"]
+            change = "{:+.1f}%".format((ratio - 1.0) * 100.0)
+        print("  {:<10} {:>10} {:>10.3f} {:>12.1f} {:>12.1f} {:>10}".format(
+            stage, result["requests"], result["cpu_s"], result["network_s"], result["modeled_s"], change))
+
+def _find_previous(history, record):
+    """
+    Find the most recent result in the history with the same settings
+    """
+    for entry in reversed(history):
+        if entry["source"] == record["source"] and entry["latency"] == record["latency"]:
+            return entry
+    return None
+
+def _load_history(path):
+    """
+    Load all previous results from the history file
+    """
+    history = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    history.append(json.loads(line))
+    return history
+
+def _append_history(path, record):
+    """
+    Add one result to the end of the history file
+    """
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(json.dumps(record) + "\n")
+
+def _get_commit():
+    """
+    Get the current git commit so results can be matched to code versions.
+    Returns None if git isn't available.
+    """
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    if output.returncode != 0:
+        return None
+    return output.stdout.strip()
+
+if __name__ == "__main__":
+    main()
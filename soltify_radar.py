@@ -6,13 +6,19 @@ Script to find and track new music releases that you may be interested in
 See README.md for full description, run with -h option for usage.
 """
 import argparse
+import time
 from datetime import datetime, timedelta
 
 from soltify.common import spotify
 from soltify.common import file_manager
 from soltify.common import log
+from soltify.common import replay
+from soltify.common import song_table
+from soltify.common import stage_timer
 from soltify.common import taste_profile
 
+from soltify.radar import budget
+from soltify.radar import pipeline
 from soltify.radar import release_finder
 from soltify.radar import release_manager
 from soltify.radar import rating_finder
@@ -39,7 +45,33 @@ MAX_NUM_DAYS = 365
 ALBUM_PLAYLIST_NAME = "Soltify Radar: Albums"
 SINGLE_PLAYLIST_NAME = "Soltify Radar: Singles"
 
-def main():
+# Stages of a run that can be resumed from a checkpoint, in order
+STAGE_LIBRARY = "library"
+STAGE_TASTE = "taste"
+STAGE_RELEASES = "releases"
+
+# Minimum number of seconds between checkpoints written in the middle of a stage
+CHECKPOINT_INTERVAL = 10.0
+
+g_last_checkpoint_time = 0.0
+
+def save_checkpoint(directory, checkpoint, force=False):
+    """
+    Save a checkpoint of the current run. Unless force=True, this is skipped if
+    a checkpoint was saved within the last CHECKPOINT_INTERVAL seconds, so it is
+    cheap to call after every page or artist.
+    """
+    global g_last_checkpoint_time
+
+    now = time.time()
+    if force or now - g_last_checkpoint_time >= CHECKPOINT_INTERVAL:
+        file_manager.save_checkpoint(directory, checkpoint)
+        g_last_checkpoint_time = now
+
+def parse_args(argv=None):
+    """
+    Parse command line arguments (from sys.argv unless argv is given)
+    """
     parser = argparse.ArgumentParser(
       description='Soltify Radar: a better new music release tracker')
 
@@ -72,6 +104,21 @@ def main():
         help="Directory to save/load output .csv files from (default=soltify_output)")
     file_group.add_argument("--cache-dir", type=str, default="soltify_cache", 
         help="Directory to save/load cached playlists from (default=soltify_cache)")
+    file_group.add_argument("--cache-codec", type=str, choices=file_manager.CACHE_CODECS,
+        default=file_manager.DEFAULT_CACHE_CODEC,
+        help="Compress cache files with this codec (lz4 and zstd must be installed). Cache files load whatever "
+             "codec they were saved with. (default={})".format(file_manager.DEFAULT_CACHE_CODEC))
+    file_group.add_argument("--resume", action="store_true",
+        help="Resume an interrupted run from the last checkpoint saved in the cache directory")
+    file_group.add_argument("--reconcile", action="store_true",
+        help="Check for songs that were removed from your Spotify library since the last run (takes a few extra requests)")
+    file_group.add_argument("--stats", nargs="?", const="", metavar="JSON_FILE",
+        help="Print a summary of Spotify API usage per endpoint when done, and optionally save it to a .json file")
+    file_group.add_argument("--record", type=str, metavar="FILE",
+        help="Save every response from Spotify to a file that soltify_bench.py can replay offline")
+    file_group.add_argument("--profile", action="store_true",
+        help="Profile where the CPU time of each stage goes and save the profiles to {}/ in the cache directory".format(
+            stage_timer.PROFILE_DIRNAME))
 
     scoring_group = parser.add_argument_group("advanced release scoring parameters")
     scoring_group.add_argument("--taste-pts0", type=float, default=1.0,
@@ -81,33 +128,97 @@ def main():
     scoring_group.add_argument("--taste-years", type=float, default=15,
         help="Only include songs released within this many years in taste profile [default:15]")
 
+    performance_group = parser.add_argument_group("performance options")
+    performance_group.add_argument("--pipeline", action="store_true",
+        help="Search for new releases and critic reviews while the taste profile is still being updated")
+    performance_group.add_argument("--scan-strategy", type=str, choices=release_finder.SCAN_STRATEGIES,
+        default=release_finder.SCAN_STRATEGY_ARTIST,
+        help="How to search for new releases: scan every artist in the taste profile, or read Spotify's new release "
+             "feed and scan only the top {} artists (much faster for large taste profiles, but can miss releases "
+             "by other artists) (default={})".format(release_finder.FEED_FALLBACK_ARTISTS,
+                                                      release_finder.SCAN_STRATEGY_ARTIST))
+    performance_group.add_argument("--max-requests", type=int,
+        help="Stop searching for new releases before making more than this many requests to Spotify. "
+             "Artists that weren't searched are searched first next run.")
+    performance_group.add_argument("--deadline", type=float, metavar="MINUTES",
+        help="Stop searching for new releases before the run takes longer than this many minutes. "
+             "Artists that weren't searched are searched first next run.")
+    performance_group.add_argument("--workers", type=int, default=taste_profile.RELATED_ARTIST_WORKERS,
+        help="Number of requests to make to Spotify at the same time when fetching related artists [default:{}]".format(
+            taste_profile.RELATED_ARTIST_WORKERS))
+
     sorting_group = parser.add_argument_group("advanced release sorting parameters")
     sorting_group.add_argument("--weight-taste", type=float, default=0.75,
         help="Weight factor to apply to Taste Score when calculating a release's final score for sorting [default:0.75]")
     sorting_group.add_argument("--weight-critic", type=float, default=0.25,
         help="Weight factor to apply to Critic Rating when calculating a release's final score for sorting [default:0.25]")
 
-    args = parser.parse_args()
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+
+    # Create the spotify client. It connects (and authenticates if needed) the
+    # first time it is used, so runs that don't need Spotify skip this.
+    sp = spotify.Spotify()
+    run(args, sp)
 
+def run(args, sp):
+    """
+    Run Soltify Radar once for one account, with arguments from parse_args()
+    and a Spotify client for that account
+    """
     if args.max_days > MAX_NUM_DAYS:
         log.error("--max-days cannot be greater than {}. It is set to {}.".format(MAX_NUM_DAYS, args.max_days))
         return
+    try:
+        file_manager.set_cache_codec(args.cache_dir, args.cache_codec)
+    except RuntimeError as err:
+        log.error(err)
+        return
 
-    current_time = datetime.now()
+    timer = stage_timer.StageTimer(stage_timer.profile_dir(args.cache_dir, "radar") if args.profile else None)
+
+    # Check if we are resuming a run that was interrupted. Otherwise, start a new
+    # checkpoint for this run.
+    checkpoint = None
+    if args.resume:
+        checkpoint = file_manager.load_checkpoint(args.cache_dir)
+        if checkpoint is None:
+            log.warning("No checkpoint found in cache. Starting a new run.")
+        else:
+            print("Resuming interrupted run from stage: {}".format(checkpoint["stage"]))
+    if checkpoint is None:
+        checkpoint = {"stage": STAGE_LIBRARY, "run_time": datetime.now()}
+
+    current_time = checkpoint["run_time"]
     show_progress = False
     show_songs = True
 
-    # Open connection to spotify
-    sp = spotify.Spotify()
-    sp.connect()
+    if args.record:
+        sp.sp = replay.RecordingClient(sp.sp)
+
+    run_budget = None
+    if args.max_requests is not None or args.deadline is not None:
+        deadline = None if args.deadline is None else args.deadline * 60
+        run_budget = budget.Budget(sp, args.max_requests, deadline)
+        if args.pipeline:
+            log.warning("--pipeline can't search artists in score order, so it is ignored with a budget")
+            args.pipeline = False
+    if args.pipeline and args.scan_strategy == release_finder.SCAN_STRATEGY_FEED:
+        log.warning("--pipeline scans every artist, so it is ignored with --scan-strategy={}".format(
+            args.scan_strategy))
+        args.pipeline = False
 
     # Check if this user's library has previously been saved. If it has, load it now
+    timer.start("load cache")
     print("Loading Spotify library from cache...")
     if file_manager.library_cache_exists(args.cache_dir):
         [songs, taste, last_run_time] = file_manager.load_library(args.cache_dir)
+        songs = song_table.SongTable(songs)
     else:
         log.warning("No library found in cache. We will need to load the entire library.")
-        songs = []
+        songs = song_table.SongTable()
         taste = dict()
         last_run_time = current_time - timedelta(days=MAX_NUM_DAYS)
         # We will be loading a lot of songs all at once, so show progress during the loading
@@ -115,7 +226,32 @@ def main():
         show_progress = True
         show_songs = False
 
+    # The taste profile is updated in place, so an interrupted run saves its own copy
+    if "taste" in checkpoint:
+        taste = checkpoint["taste"]
+
+    # Plan the run before making any requests. Only the new songs found by an
+    # interrupted run are known yet, so the taste and release stages are lower
+    # bounds.
+    pending = file_manager.load_pending_artists(args.cache_dir)
+    if run_budget:
+        print("Planning requests...")
+        plan = {"library": 0}
+        if checkpoint["stage"] == STAGE_LIBRARY:
+            plan["library"] = budget.plan_library_requests(songs, last_run_time, current_time, args.reconcile)
+        planned_songs = checkpoint.get("new_songs", [])
+        if args.scan_strategy == release_finder.SCAN_STRATEGY_FEED:
+            plan.update(budget.plan_requests(planned_songs, taste, args.taste_years, args.taste_pts0,
+                                             args.taste_pts1, args.taste_thresh,
+                                             release_finder.FEED_FALLBACK_ARTISTS, pending))
+            plan["feed"] = budget.FEED_REQUESTS
+        else:
+            plan.update(budget.plan_requests(planned_songs, taste, args.taste_years, args.taste_pts0,
+                                             args.taste_pts1, args.taste_thresh))
+        budget.print_plan(plan, run_budget)
+
     # Check if there are song lists from a previous run
+    timer.start("load previous run")
     print("Loading previous run's data...")
     if file_manager.release_lists_exist(args.out_dir):
         # Load data from the .csv files
@@ -149,40 +285,117 @@ def main():
             singles_playlist_uri = sp.create_playlist(SINGLE_PLAYLIST_NAME)
     
     # Read this user's spotify library and add any songs that aren't already in the song list
+    timer.start("load library")
     print("Loading updates from Spotify library...")
-    new_songs = sp.load_library(songs, show_progress)
-    songs.extend(new_songs)
+    if checkpoint["stage"] == STAGE_LIBRARY:
+        def on_page(new_songs, offset):
+            checkpoint["new_songs"] = new_songs
+            checkpoint["library_offset"] = offset
+            save_checkpoint(args.cache_dir, checkpoint)
+        num_cached = len(songs)
+        new_songs = sp.load_library(songs, show_progress, checkpoint.get("new_songs"),
+                                    checkpoint.get("library_offset", 0), on_page)
+        songs.extend(new_songs)
+        removed_songs = []
+        if args.reconcile and num_cached:
+            print("Checking for songs removed from Spotify library...")
+            removed_songs = sp.reconcile_library(songs)
+            taste_profile.remove_from_taste_profile(removed_songs, taste, args.taste_years)
+        checkpoint["stage"] = STAGE_TASTE
+        checkpoint["new_songs"] = new_songs
+        checkpoint["removed_songs"] = removed_songs
+        checkpoint["taste"] = taste
+        checkpoint["taste_done"] = set()
+        save_checkpoint(args.cache_dir, checkpoint, force=True)
+    else:
+        new_songs = checkpoint["new_songs"]
+        songs.extend(new_songs)
+    removed_songs = checkpoint.get("removed_songs", [])
+    if removed_songs:
+        songs.remove_uris(set(song["uri"] for song in removed_songs))
     if show_songs:
         for song in new_songs:
             print("  Recently added: {} - {}".format(song["artist"], song["name"]))
+        for song in removed_songs:
+            print("  Removed: {} - {}".format(song["artist"], song["name"]))
 
-    print("Updating taste profile...")
-    taste_profile.update_taste_profile(new_songs, taste, args.taste_years, sp, show_progress)
-    taste_profile.assign_scores(taste, args.taste_pts0, args.taste_pts1)
-    taste_filtered = taste_profile.sort_and_filter(taste, args.taste_thresh)
-
-    # Search spotify for new releases
-    print("Searching for new releases...")
     min_time = current_time - timedelta(days=args.max_days)
+    unscanned = []
     allow_flags = [args.allow_remaster, args.allow_live, args.allow_acoustic, args.allow_remix, args.allow_cover]
-    print("TODO: this override is for debug")
-    # release_finder.find_releases(sp, taste_filtered, max(min_time, last_run_time), album_releases, single_releases, allow_flags, args.force_filter)
-    release_finder.find_releases(sp, taste_filtered, min_time, album_releases, single_releases, allow_flags, args.force_filter)
+    def on_artist(taste, done):
+        save_checkpoint(args.cache_dir, checkpoint)
+    if args.pipeline and checkpoint["stage"] == STAGE_TASTE:
+        # Update the taste profile, search for new releases and look up critic
+        # reviews all at once. Filtering may prompt the user, so it waits
+        # until everything else is done.
+        timer.start("pipeline")
+        print("Updating taste profile, searching for new releases and critic reviews...")
+        taste_filtered, albums, singles = pipeline.run_pipeline(
+            sp, new_songs, taste, args.taste_years, args.taste_pts0, args.taste_pts1, args.taste_thresh,
+            min_time, album_releases, args.workers, show_progress, checkpoint["taste_done"], on_artist)
+        checkpoint["stage"] = STAGE_RELEASES
+        checkpoint["release_index"] = len(taste_filtered)
+        checkpoint["albums"] = albums
+        checkpoint["singles"] = singles
+        save_checkpoint(args.cache_dir, checkpoint, force=True)
+        release_finder.filter_releases(albums, singles, album_releases, single_releases, allow_flags,
+                                       args.force_filter)
+    else:
+        timer.start("taste profile")
+        print("Updating taste profile...")
+        if checkpoint["stage"] == STAGE_TASTE:
+            skipped = taste_profile.update_taste_profile(new_songs, taste, args.taste_years, sp, show_progress,
+                                                         checkpoint["taste_done"], on_artist, args.workers,
+                                                         budget=run_budget)
+            if skipped:
+                # The library isn't saved, so the next run picks these songs
+                # up again
+                save_checkpoint(args.cache_dir, checkpoint, force=True)
+                log.warning("The budget ran out while updating the taste profile, with {} artists left. "
+                            "Run again with --resume to continue.".format(len(skipped)))
+                return
+            checkpoint["stage"] = STAGE_RELEASES
+            checkpoint["release_index"] = 0
+            checkpoint["albums"] = []
+            checkpoint["singles"] = []
+            save_checkpoint(args.cache_dir, checkpoint, force=True)
+        taste_profile.assign_scores(taste, args.taste_pts0, args.taste_pts1)
+        taste_filtered = taste_profile.sort_and_filter(taste, args.taste_thresh)
+
+        # Search spotify for new releases
+        timer.start("releases")
+        print("Searching for new releases...")
+        print("TODO: this override is for debug")
+        # release_finder.find_releases(sp, taste_filtered, max(min_time, last_run_time), album_releases, single_releases, allow_flags, args.force_filter)
+        def on_release_artist(next_index, albums, singles):
+            checkpoint["release_index"] = next_index
+            checkpoint["albums"] = albums
+            checkpoint["singles"] = singles
+            save_checkpoint(args.cache_dir, checkpoint)
+        unscanned = release_finder.find_releases(
+            sp, taste_filtered, min_time, album_releases, single_releases, allow_flags, args.force_filter,
+            checkpoint["release_index"], (checkpoint["albums"], checkpoint["singles"]), on_release_artist,
+            run_budget, pending, args.scan_strategy)
+        save_checkpoint(args.cache_dir, checkpoint, force=True)
 
-    # Lookup critic scores for all releases in list (both old and new)
-    print("Searching for critic reviews...")
-    rating_finder.find_critic_ratings(album_releases)
+        # Lookup critic scores for all releases in list (both old and new)
+        timer.start("critic ratings")
+        print("Searching for critic reviews...")
+        rating_finder.find_critic_ratings(album_releases)
 
     # Find more releases based on critic score
+    timer.start("top albums")
     print("Searching for highly rated albums we missed...")
     rating_finder.add_top_albums(album_releases, args.critic_thresh, min_time, args.critic_genres)
 
     # Sort release list
+    timer.start("sort")
     print("Finalizing lists and writing output...")
     release_manager.sort(album_releases, args.weight_taste, args.weight_critic)
     release_manager.sort(single_releases, 0.0, 1.0)
 
     # Write all output
+    timer.start("write output")
     file_manager.save_taste_profile(args.out_dir, taste_filtered)
     file_manager.save_release_lists(args.out_dir, album_releases, single_releases)
     album_uris = release_manager.get_songs_for_playlist(album_releases)
@@ -191,6 +404,18 @@ def main():
     # sp.write_playlist(albums_playlist_uri, album_uris, True)
     # sp.write_playlist(singles_playlist_uri, singles_uris, True)
     file_manager.save_library(args.cache_dir, songs, taste, current_time)
+    file_manager.save_pending_artists(args.cache_dir, unscanned)
+    file_manager.clear_checkpoint(args.cache_dir)
+    timer.stop()
+    if args.stats is not None or args.profile:
+        timer.print_summary()
+        timer.save()
+    if args.stats is not None:
+        sp.stats.print_summary()
+        if args.stats:
+            sp.stats.save(args.stats)
+    if args.record:
+        sp.sp.save(args.record)
     print("Done!")
 
 
@@ -0,0 +1,299 @@
+"""
+Soltify Radar Daemon
+
+Script that keeps running and runs Soltify Radar on a schedule for several
+Spotify accounts. Each account stays logged in between runs, and data about
+artists (related artists and discographies) is shared between
+all accounts, so an artist fetched for one account is not fetched again for
+the next.
+
+A running daemon can be controlled through a local socket, e.g. to start a run
+right away or check the status of each account (see --send). Each command must
+start with a token that the daemon writes to its cache directory, readable only
+by the user running it, so other users on the machine can't control it.
+
+See README.md for full description, run with -h option for usage.
+"""
+import argparse
+import hmac
+import json
+import os
+import queue
+import secrets
+import socket
+import socketserver
+import threading
+import time
+import traceback
+
+from soltify.common import artist_cache
+from soltify.common import file_manager
+from soltify.common import log
+from soltify.common import spotify
+
+import soltify_radar
+
+# Port the control socket listens on (on localhost only) unless the config
+# file sets "control_port"
+DEFAULT_CONTROL_PORT = 8737
+
+# File in the shared cache directory that holds the token control commands
+# must start with
+CONTROL_TOKEN_FILENAME = "daemon_token"
+
+# Hours between scheduled runs of an account unless its "interval_hours" is set
+DEFAULT_INTERVAL_HOURS = 24
+
+# Directory the shared artist cache is saved to unless the config file sets
+# "cache_dir"
+DEFAULT_SHARED_CACHE_DIR = "soltify_shared_cache"
+
+# Seconds between checks for accounts that are due to run
+SCHEDULER_INTERVAL = 30.0
+
+# States of an account
+STATE_IDLE = "idle"
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+
+class RadarDaemon:
+    """
+    Schedules and runs Soltify Radar for several accounts, one run at a time
+    """
+    def __init__(self, config):
+        self.cache_dir = config.get("cache_dir", DEFAULT_SHARED_CACHE_DIR)
+        self.port = config.get("control_port", DEFAULT_CONTROL_PORT)
+        if "cache_codec" in config:
+            file_manager.set_cache_codec(self.cache_dir, config["cache_codec"])
+
+        # Everything artist related and the request budget (which Spotify
+        # enforces per app, not per account) are shared by all accounts
+        self.artist_cache = file_manager.load_artist_cache(self.cache_dir)
+        if self.artist_cache is None:
+            self.artist_cache = artist_cache.ArtistCache()
+        self.rate_limiter = spotify.RateLimiter()
+
+        self.accounts = dict()
+        cache_dirs = set()
+        for account in config["accounts"]:
+            name = account["name"]
+            # Nobody is around to answer prompts, so always filter without asking
+            args = soltify_radar.parse_args(account.get("args", []) + ["--force-filter"])
+            if args.cache_dir in cache_dirs:
+                log.warning("Account {} shares --cache-dir {} with another account".format(name, args.cache_dir))
+            cache_dirs.add(args.cache_dir)
+            auth_cache_path = account.get("auth_cache", ".cache-{}".format(name))
+            self.accounts[name] = {
+                "args": args,
+                "sp": spotify.Spotify(self.rate_limiter, self.artist_cache, auth_cache_path),
+                "interval": account.get("interval_hours", DEFAULT_INTERVAL_HOURS) * 60 * 60,
+                "next_run": time.time(),
+                "state": STATE_IDLE,
+                "last_run": None,
+                "last_duration": None,
+                "last_error": None,
+                "runs": 0,
+            }
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.token = None
+
+    def connect(self):
+        """
+        Log in to every account up front, since the first login may need the
+        user to paste a URL into the console. Raises RuntimeError if any
+        account can't log in.
+        """
+        for name, account in self.accounts.items():
+            print("Connecting to Spotify account: {}...".format(name))
+            try:
+                account["sp"].login()
+            except RuntimeError as err:
+                raise RuntimeError("Account {}: {}".format(name, err))
+
+    def request_run(self, name):
+        """
+        Queue a run for an account. Returns False if the account doesn't exist
+        or already has a run queued or running.
+        """
+        with self.lock:
+            if not name in self.accounts or self.accounts[name]["state"] != STATE_IDLE:
+                return False
+            self.accounts[name]["state"] = STATE_QUEUED
+        self.queue.put(name)
+        return True
+
+    def status(self):
+        """
+        Get the status of each account and the shared request budget
+        """
+        with self.lock:
+            accounts = dict()
+            for name, account in self.accounts.items():
+                accounts[name] = {key: account[key] for key in
+                    ["state", "next_run", "last_run", "last_duration", "last_error", "runs"]}
+        return {"accounts": accounts, "throughput": self.rate_limiter.throughput()}
+
+    def stop(self):
+        """
+        Ask the daemon to stop once the current run (if any) finishes
+        """
+        self.stopping.set()
+
+    def run_forever(self):
+        """
+        Run queued accounts until stop() is called
+        """
+        self.token = _write_control_token(self.cache_dir)
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", self.port), _ControlHandler)
+        server.daemon_threads = True
+        server.radar_daemon = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._schedule, daemon=True).start()
+        print("Listening for commands on port {}".format(self.port))
+
+        try:
+            while not self.stopping.is_set():
+                try:
+                    name = self.queue.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                self._run_account(name)
+        finally:
+            server.shutdown()
+            file_manager.save_artist_cache(self.cache_dir, self.artist_cache)
+
+    ############################################################################
+    # Private Functions
+    ############################################################################
+    def _schedule(self):
+        """
+        Queue a run for each account whenever it is due
+        """
+        while not self.stopping.is_set():
+            now = time.time()
+            for name, account in self.accounts.items():
+                if account["next_run"] <= now:
+                    self.request_run(name)
+            self.stopping.wait(SCHEDULER_INTERVAL)
+
+    def _run_account(self, name):
+        """
+        Run Soltify Radar for one account and record how it went
+        """
+        account = self.accounts[name]
+        with self.lock:
+            account["state"] = STATE_RUNNING
+        print("Starting Soltify Radar for account: {}".format(name))
+        start = time.time()
+        error = None
+        try:
+            soltify_radar.run(account["args"], account["sp"])
+        except Exception as err:
+            traceback.print_exc()
+            log.error("Run for account {} failed: {}".format(name, err))
+            error = str(err)
+        with self.lock:
+            account["state"] = STATE_IDLE
+            account["last_run"] = start
+            account["last_duration"] = time.time() - start
+            account["last_error"] = error
+            account["runs"] += 1
+            account["next_run"] = start + account["interval"]
+
+        # Save what this run learned about artists so other accounts (and the
+        # next daemon) can use it
+        self.artist_cache.expire()
+        file_manager.save_artist_cache(self.cache_dir, self.artist_cache)
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one command sent to the control socket. Commands are a single line
+    that starts with the daemon's token, followed by one of:
+      status       - get the status of each account
+      run <name>   - run an account now
+      stop         - stop the daemon after the current run
+    and get back a single line of JSON.
+    """
+    def handle(self):
+        daemon = self.server.radar_daemon
+        token, _, line = self.rfile.readline().decode("utf-8").strip().partition(" ")
+        command, _, argument = line.partition(" ")
+        if not hmac.compare_digest(token.encode("utf-8"), daemon.token.encode("utf-8")):
+            response = {"error": "Invalid token"}
+        elif command == "status":
+            response = daemon.status()
+        elif command == "run":
+            response = {"queued": daemon.request_run(argument)}
+        elif command == "stop":
+            daemon.stop()
+            response = {"stopping": True}
+        else:
+            response = {"error": "Unknown command: {}".format(command)}
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+def send_command(port, cache_dir, command):
+    """
+    Send a command to a running daemon (using the token it saved to its cache
+    directory) and return its response
+    """
+    with open(os.path.join(cache_dir, CONTROL_TOKEN_FILENAME), encoding="utf-8") as file:
+        token = file.read().strip()
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall((token + " " + command + "\n").encode("utf-8"))
+        with sock.makefile("r", encoding="utf-8") as file:
+            return json.loads(file.readline())
+
+def _write_control_token(directory):
+    """
+    Make a new random token for the control socket and save it to a file in
+    the cache directory that only this user can read
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    token = secrets.token_hex(16)
+    path = os.path.join(directory, CONTROL_TOKEN_FILENAME)
+    # Remove any old token first, since its permissions might be looser
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as file:
+        file.write(token)
+    return token
+
+def main():
+    parser = argparse.ArgumentParser(
+      description='Soltify Radar Daemon: run Soltify Radar on a schedule for several accounts')
+    parser.add_argument("config", type=str,
+        help="JSON file listing the accounts to run (see README.md)")
+    parser.add_argument("--send", type=str, metavar="COMMAND",
+        help="Send a command (status, \"run <account>\" or stop) to a daemon that is already running, then exit")
+
+    args = parser.parse_args()
+
+    with open(args.config, encoding="utf-8") as file:
+        config = json.load(file)
+
+    if args.send:
+        try:
+            response = send_command(config.get("control_port", DEFAULT_CONTROL_PORT),
+                                    config.get("cache_dir", DEFAULT_SHARED_CACHE_DIR), args.send)
+        except OSError as err:
+            log.error("Could not reach daemon: {}".format(err))
+            return
+        print(json.dumps(response, indent=2))
+        return
+
+    daemon = RadarDaemon(config)
+    try:
+        daemon.connect()
+    except RuntimeError as err:
+        log.error(err)
+        return
+    daemon.run_forever()
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Soltify Radar Sweep
+
+Script to try many taste scoring parameters of Soltify Radar at once, using the
+library and taste profile cached by a previous run of soltify_radar.py. It
+doesn't connect to Spotify, so it runs in seconds even for large grids.
+
+For each combination of parameters it reports how many artists would have their
+releases searched, how many of those the default parameters would also search,
+and roughly how many requests searching them would take.
+
+See README.md for full description, run with -h option for usage.
+"""
+import argparse
+
+from soltify.common import file_manager
+from soltify.common import log
+
+from soltify.radar import sweep
+
+import soltify_radar
+
+# Values of each parameter tried by default
+DEFAULT_TASTE_PTS0 = [1.0]
+DEFAULT_TASTE_PTS1 = [0.0, 0.1, 0.2, 0.3, 0.5]
+DEFAULT_TASTE_THRESH = [1.0, 2.0, 3.0, 5.0, 8.0]
+DEFAULT_TASTE_YEARS = [5, 10, 15, 25]
+
+# Number of top artists listed for the chosen parameters
+TOP_ARTISTS = 10
+
+def main():
+    # Compare against whatever soltify_radar.py uses by default
+    defaults = soltify_radar.parse_args([])
+
+    parser = argparse.ArgumentParser(
+      description='Soltify Radar Sweep: compare taste scoring parameters offline')
+
+    grid_group = parser.add_argument_group("parameter grid")
+    grid_group.add_argument("--taste-pts0", type=float, nargs='+', default=DEFAULT_TASTE_PTS0,
+        help="Values of --taste-pts0 to try [default:{}]".format(_format_list(DEFAULT_TASTE_PTS0)))
+    grid_group.add_argument("--taste-pts1", type=float, nargs='+', default=DEFAULT_TASTE_PTS1,
+        help="Values of --taste-pts1 to try [default:{}]".format(_format_list(DEFAULT_TASTE_PTS1)))
+    grid_group.add_argument("--taste-thresh", type=float, nargs='+', default=DEFAULT_TASTE_THRESH,
+        help="Values of --taste-thresh to try [default:{}]".format(_format_list(DEFAULT_TASTE_THRESH)))
+    grid_group.add_argument("--taste-years", type=float, nargs='+', default=DEFAULT_TASTE_YEARS,
+        help="Values of --taste-years to try [default:{}]".format(_format_list(DEFAULT_TASTE_YEARS)))
+
+    target_group = parser.add_argument_group("choosing parameters")
+    target_group.add_argument("--target-artists", type=int,
+        help="Choose the parameters that search the number of artists closest to this")
+    target_group.add_argument("--max-requests", type=int,
+        help="Choose the parameters that search the most artists within this many requests")
+
+    file_group = parser.add_argument_group("file options")
+    file_group.add_argument("--cache-dir", type=str, default=defaults.cache_dir,
+        help="Directory soltify_radar.py saved its cache to (default={})".format(defaults.cache_dir))
+    file_group.add_argument("--out-dir", type=str,
+        help="Save the taste profile of the chosen parameters to a .csv file in this directory")
+
+    args = parser.parse_args()
+
+    if not file_manager.library_cache_exists(args.cache_dir):
+        log.error("No library found in {}. Run soltify_radar.py first.".format(args.cache_dir))
+        return
+
+    print("Loading Spotify library from cache...")
+    songs, taste, last_run_time = file_manager.load_library(args.cache_dir)
+    graph = sweep.TasteGraph(songs, taste)
+
+    baseline = (defaults.taste_pts0, defaults.taste_pts1, defaults.taste_thresh, defaults.taste_years)
+    num_combinations = (len(args.taste_pts0) * len(args.taste_pts1) * len(args.taste_thresh) *
+                        len(args.taste_years))
+    print("Evaluating {} combinations...".format(num_combinations))
+    results = sweep.evaluate(graph, args.taste_pts0, args.taste_pts1, args.taste_thresh, args.taste_years,
+                             baseline)
+
+    best = sweep.choose(results, args.target_artists, args.max_requests)
+    _print_results(results, best)
+
+    for years in args.taste_years:
+        missing = graph.missing_related(graph.counts(years)[0])
+        if missing:
+            log.warning("{} artists with songs from the last {} years have no related artists cached, "
+                        "so scores with --taste-years={} are too low".format(missing, years, years))
+
+    if best is None:
+        log.error("No combination fits in {} requests".format(args.max_requests))
+        return
+
+    # Only the chosen parameters get a full taste profile
+    chosen = sweep.build_taste(graph, best)
+    print("Chosen parameters:")
+    print("  --taste-pts0={} --taste-pts1={} --taste-thresh={} --taste-years={}".format(
+        best["taste_pts0"], best["taste_pts1"], best["taste_thresh"], best["taste_years"]))
+    print("Top artists:")
+    for artist_id, entry in list(chosen.items())[:TOP_ARTISTS]:
+        print("  {:>8.2f}  {}".format(entry["score"], entry["artist_name"]))
+    if args.out_dir:
+        file_manager.save_taste_profile(args.out_dir, chosen)
+    print("Done!")
+
+def _format_list(values):
+    return " ".join(str(value) for value in values)
+
+def _print_results(results, best):
+    """
+    Print a table of every combination, marking the chosen one
+    """
+    print("  {:>6} {:>6} {:>6} {:>6} {:>8} {:>8} {:>8} {:>9}".format(
+        "Years", "Pts0", "Pts1", "Thresh", "Artists", "Overlap", "Jaccard", "Requests"))
+    for result in results:
+        print("{} {:>6g} {:>6g} {:>6g} {:>6g} {:>8} {:>8} {:>8.2f} {:>9}".format(
+            "*" if result is best else " ", result["taste_years"], result["taste_pts0"],
+            result["taste_pts1"], result["taste_thresh"], result["artists"], result["overlap"],
+            result["jaccard"], result["requests"]))
+
+if __name__ == "__main__":
+    main()
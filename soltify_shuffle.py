@@ -6,66 +6,165 @@ Script to shuffle a Spotify playlist better than Spotify does.
 See README.md for full description, run with -h option for usage.
 """
 import argparse
+import concurrent.futures
+import fnmatch
+import itertools
 
 from soltify.common import spotify
 from soltify.common import file_manager
 from soltify.common import log
+from soltify.common import replay
+from soltify.common import stage_timer
 
 from soltify.shuffle import shuffle
 
+def parse_spacing(text):
+    """
+    Parse a KEY[:WEIGHT] argument for --spacing into a (key, weight) pair
+    """
+    key, _, weight = text.partition(":")
+    if not key in shuffle.SPACING_KEYS:
+        raise argparse.ArgumentTypeError("unknown spacing key: {}".format(key))
+    try:
+        return key, float(weight) if weight else 1.0
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid weight: {}".format(weight))
+
 def main():
     parser = argparse.ArgumentParser(
       description='Soltify Shuffle: a better shuffle for Spotify playlists')
-    parser.add_argument("playlist", type=str, 
-      help="Name of playlist to shuffle")
+    parser.add_argument("playlists", type=str, nargs='+', metavar="playlist",
+      help="Name of playlist to shuffle. Several can be given, and wildcards can" \
+           " be used to shuffle every playlist with a matching name (e.g." \
+           " \"Rotation *\")")
 
     shuffle_group = parser.add_argument_group("shuffle options")
     shuffle_group.add_argument("--ignoreartist", action="store_true",
       help="Do a truly random shuffle, without trying to evenly space out songs" \
            " by the same artist.")
+    shuffle_group.add_argument("--spacing", type=parse_spacing, nargs='+',
+      default=shuffle.DEFAULT_SPACING, metavar="KEY[:WEIGHT]",
+      help="Keys to evenly space out songs by, most important first, with an" \
+           " optional weight for each (e.g. artist album:0.5 year:0.2). Keys:" \
+           " {} (default=artist)".format(", ".join(shuffle.SPACING_KEYS)))
+    shuffle_group.add_argument("--workers", type=int, default=4,
+      help="Number of playlists to load, shuffle and write at the same time" \
+           " (default=4)")
 
     cache_group = parser.add_argument_group("local cache options")
     cache_group.add_argument("--cachedir", type=str, default="soltify_cache", 
       help="Directory to save/load cached playlists from (default=soltify_cache)")
+    cache_group.add_argument("--cache-codec", type=str, choices=file_manager.CACHE_CODECS,
+      default=file_manager.DEFAULT_CACHE_CODEC,
+      help="Compress cached playlists with this codec (lz4 and zstd must be" \
+           " installed). Cached files load whatever codec they were saved with." \
+           " (default={})".format(file_manager.DEFAULT_CACHE_CODEC))
     cache_group.add_argument("--uselocal", action="store_true", 
       help="Load the playlist from the local cache instead of reloading it from" \
            " Spotify. This will run much faster, but will not pick up any changes" \
            " made to the playlist since last time Soltify tools loaded it.")
 
+    stats_group = parser.add_argument_group("diagnostic options")
+    stats_group.add_argument("--stats", nargs="?", const="", metavar="JSON_FILE",
+      help="Print a summary of Spotify API usage per endpoint when done, and" \
+           " optionally save it to a .json file")
+    stats_group.add_argument("--record", type=str, metavar="FILE",
+      help="Save every response from Spotify to a file that soltify_bench.py" \
+           " can replay offline")
+    stats_group.add_argument("--profile", action="store_true",
+      help="Profile where the CPU time of each stage goes and save the" \
+           " profiles to {}/ in the cache directory".format(stage_timer.PROFILE_DIRNAME))
+
     args = parser.parse_args()
 
-    # Open connection to spotify
+    try:
+        file_manager.set_cache_codec(args.cachedir, args.cache_codec)
+    except RuntimeError as err:
+        log.error(err)
+        return
+
+    timer = stage_timer.StageTimer(stage_timer.profile_dir(args.cachedir, "shuffle") if args.profile else None)
+
+    # Create the spotify client. It connects (and authenticates if needed) the
+    # first time it is used, so runs that don't need Spotify skip this.
     sp = spotify.Spotify()
-    sp.connect()
+    if args.record:
+        sp.sp = replay.RecordingClient(sp.sp)
 
-    # Load songs from the playlist
-    if args.uselocal:
-        print("Loading playlist from cache...")
-        # Try to load from a local cache file
-        try:
-            songs, playlist_uri = file_manager.load_playlist(args.cachedir, args.playlist)
-        except RuntimeError as err:
-            log.error(err)
+    timer.start("find playlists")
+    # Find the playlists to shuffle. Cached playlists can be loaded by name, but
+    # wildcards have to be matched against the user's playlists in Spotify.
+    if args.uselocal and not any(spotify.is_pattern(p) for p in args.playlists):
+        playlist_uris = {name: None for name in args.playlists}
+    else:
+        print("Finding playlists in Spotify...")
+        playlist_uris = sp.find_playlists(args.playlists)
+        for pattern in args.playlists:
+            if not any(name == pattern or fnmatch.fnmatchcase(name, pattern) for name in playlist_uris):
+                log.error("No playlist with name {} found in user library".format(pattern))
+        if not playlist_uris:
             return
+
+    # Load songs from the playlists
+    timer.start("load playlists")
+    playlists = dict()
+    if args.uselocal:
+        print("Loading {} playlist(s) from cache...".format(len(playlist_uris)))
+        # Try to load from local cache files
+        for name in playlist_uris:
+            try:
+                playlists[name] = file_manager.load_playlist(args.cachedir, name)
+            except RuntimeError as err:
+                log.error(err)
     else:  # not args.uselocal
-        print("Loading playlist from Spotify...")
-        # Try to load from spotify
-        try:
-            songs, playlist_uri = sp.load_playlist(args.playlist)
-        except RuntimeError as err:
-            log.error(err)
-            return
+        print("Loading {} playlist(s) from Spotify...".format(len(playlist_uris)))
+        # Load from spotify, several at a time
+        with concurrent.futures.ThreadPoolExecutor(args.workers) as executor:
+            futures = {name: executor.submit(sp.load_playlist, name, uri)
+                       for name, uri in playlist_uris.items()}
+            for name, future in futures.items():
+                playlists[name] = future.result()
 
         # Save to the local cache for future runs
-        file_manager.save_playlist(args.cachedir, args.playlist, songs, playlist_uri)
+        timer.start("save cache")
+        for name, (songs, playlist_uri) in playlists.items():
+            file_manager.save_playlist(args.cachedir, name, songs, playlist_uri)
+    if not playlists:
+        return
+
+    timer.start("shuffle")
+    # Shuffle the songs. Shuffling is CPU bound, so use separate processes when
+    # there are several playlists.
+    names = list(playlists)
+    song_lists = [playlists[name][0] for name in names]
+    print("Shuffling {} songs...".format(sum(len(songs) for songs in song_lists)))
+    if len(names) > 1 and args.workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(min(args.workers, len(names))) as executor:
+            song_lists = list(executor.map(shuffle.shuffle, song_lists, itertools.repeat(args.ignoreartist),
+                                           itertools.repeat(args.spacing)))
+    else:
+        song_lists = [shuffle.shuffle(songs, args.ignoreartist, args.spacing) for songs in song_lists]
 
-    # Shuffle the songs
-    print("Shuffling {} songs...".format(len(songs)))
-    songs = shuffle.shuffle(songs, args.ignoreartist)
+    timer.start("write playlists")
+    # Update the playlists to be in the new shuffled order. Requests from all of
+    # them share the Spotify client's rate limit.
+    print("Updating {} playlist(s) in Spotify...".format(len(names)))
+    with concurrent.futures.ThreadPoolExecutor(args.workers) as executor:
+        futures = [executor.submit(sp.write_playlist, playlists[name][1], songs, overwrite=True)
+                   for name, songs in zip(names, song_lists)]
+        for future in futures:
+            future.result()
+    timer.stop()
 
-    # Update the playlist to be in the new shuffled order
-    print("Updating playlist in Spotify...")
-    sp.write_playlist(playlist_uri, songs, overwrite=True)
+    if args.stats is not None or args.profile:
+        timer.print_summary()
+        timer.save()
+    if args.stats is not None:
+        sp.stats.print_summary()
+        if args.stats:
+            sp.stats.save(args.stats)
+    if args.record:
+        sp.sp.save(args.record)
 
     print("Done!")
 